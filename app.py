@@ -5,7 +5,9 @@ import os
 from flask import Flask, request, jsonify, render_template, redirect
 from flask_socketio import SocketIO, emit
 from celery import Celery
-from tasks import download_channel_podcast, download_playlist_podcast, resolve_channel_url
+from tasks import download_channel_podcast, download_playlist_podcast, resolve_channel_url, resume_job
+from transcoder import ENCODING_PROFILES, PROFILE_LABELS
+from store import cancel_job, get_active_jobs
 from dotenv import load_dotenv
 import logging
 
@@ -44,7 +46,7 @@ celery = make_celery(app)
 @app.route('/')
 def index():
     logging.info("Accessed index route")
-    return render_template('index.html')
+    return render_template('index.html', encoding_profiles=ENCODING_PROFILES, profile_labels=PROFILE_LABELS)
 
 @app.route('/start-conversion', methods=['POST'])
 def start_conversion():
@@ -60,9 +62,13 @@ def start_conversion():
         title_filter = data.get('title_filter', None)
         buzzsprout_api_key = data['buzzsprout_api_key']
         buzzsprout_podcast_id = data['buzzsprout_podcast_id']
+        encoding_profile = data.get('encoding_profile') or 'default'
+        if encoding_profile not in ENCODING_PROFILES:
+            logging.error(f"Unknown encoding profile: {encoding_profile}")
+            return jsonify({"status": "error", "message": f"Unknown encoding profile, choose one of: {', '.join(ENCODING_PROFILES)}"}), 400
 
         logging.info(
-            f"Received start-conversion request: URL={url}, min_duration={min_duration}, max_duration={max_duration}, title_filter={title_filter}, buzzsprout_api_key={buzzsprout_api_key}, buzzsprout_podcast_id={buzzsprout_podcast_id}")
+            f"Received start-conversion request: URL={url}, min_duration={min_duration}, max_duration={max_duration}, title_filter={title_filter}, buzzsprout_api_key={buzzsprout_api_key}, buzzsprout_podcast_id={buzzsprout_podcast_id}, encoding_profile={encoding_profile}")
 
         resolved_url = resolve_channel_url(url, os.getenv('API_KEY'))
         logging.info(f"Resolved URL: {resolved_url}")
@@ -89,10 +95,10 @@ AWS_BUCKET_NAME={os.getenv('AWS_BUCKET_NAME')}
 
         if "playlist?list=" in resolved_url:
             task = download_playlist_podcast.apply_async(
-                args=[resolved_url, min_duration, max_duration, title_filter, user_env_path])
+                args=[resolved_url, min_duration, max_duration, title_filter, user_env_path, encoding_profile])
         elif "channel/" in resolved_url or "/@" in resolved_url:
             task = download_channel_podcast.apply_async(
-                args=[resolved_url, min_duration, max_duration, title_filter, user_env_path])
+                args=[resolved_url, min_duration, max_duration, title_filter, user_env_path, encoding_profile])
         else:
             logging.error("Invalid URL format")
             return jsonify({"status": "error", "message": "Invalid URL format"}), 400
@@ -106,22 +112,46 @@ AWS_BUCKET_NAME={os.getenv('AWS_BUCKET_NAME')}
         logging.error(f"Error in start-conversion: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/resume-conversion', methods=['POST'])
+def resume_conversion():
+    try:
+        data = request.json
+        task_id = data['task_id']
+
+        task = resume_job(task_id)
+        if not task:
+            logging.error(f"No saved job for task {task_id}")
+            return jsonify({"status": "error", "message": "Unknown task ID"}), 404
+
+        logging.info(f"Task {task.id} resumed")
+        return jsonify({"status": "started", "task_id": task.id})
+    except ValueError as e:
+        logging.error(f"Cannot resume task: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except KeyError as e:
+        logging.error(f"KeyError: {e}")
+        return jsonify({"status": "error", "message": f"Missing key: {str(e)}"}), 400
+    except Exception as e:
+        logging.error(f"Error in resume-conversion: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/stop-conversion', methods=['POST'])
 def stop_conversion():
     try:
-        # Revoke all tasks
-        i = celery.control.inspect()
-        active_tasks = i.active()
-
-        if active_tasks:
-            for worker, tasks in active_tasks.items():
-                for task in tasks:
-                    celery.control.revoke(task['id'], terminate=True)
-            logging.info("All active tasks have been terminated.")
+        # Stops the given job, or every running job. Chunks and videos check the
+        # job's cancel flag before starting, so work already queued is dropped
+        # too, while videos in progress finish and the job still reports.
+        data = request.get_json(silent=True) or {}
+        job_ids = [data['task_id']] if data.get('task_id') else get_active_jobs()
+
+        if job_ids:
+            for job_id in job_ids:
+                cancel_job(job_id)
+            logging.info(f"Stopped jobs: {', '.join(job_ids)}")
             return jsonify({"status": "stopped"})
         else:
-            logging.info("No active tasks to terminate.")
-            return jsonify({"status": "error", "message": "No active tasks to terminate"}), 400
+            logging.info("No active jobs to stop.")
+            return jsonify({"status": "error", "message": "No active jobs to stop"}), 400
 
     except Exception as e:
         logging.error(f"Error stopping conversion: {e}")
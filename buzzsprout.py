@@ -0,0 +1,103 @@
+import os
+import time
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BUZZSPROUT_CONNECT_TIMEOUT = float(os.getenv('BUZZSPROUT_CONNECT_TIMEOUT', 10))
+BUZZSPROUT_READ_TIMEOUT = float(os.getenv('BUZZSPROUT_READ_TIMEOUT', 60))
+BUZZSPROUT_MAX_RETRIES = int(os.getenv('BUZZSPROUT_MAX_RETRIES', 5))
+BUZZSPROUT_BACKOFF = float(os.getenv('BUZZSPROUT_BACKOFF', 1))
+BUZZSPROUT_MAX_BACKOFF = float(os.getenv('BUZZSPROUT_MAX_BACKOFF', 60))
+BUZZSPROUT_POOL_SIZE = int(os.getenv('BUZZSPROUT_POOL_SIZE', 4))
+# Rate limiting and unavailability mean the request wasn't handled. Any other
+# error may come after the episode was created, retrying it would duplicate it.
+BUZZSPROUT_RETRY_STATUSES = (429, 503)
+
+
+def retry_after(response):
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class BuzzsproutClient:
+    def __init__(self, api_key, podcast_id):
+        self.podcast_id = podcast_id
+        self.session = requests.Session()
+        # Only failures to connect are retried by the adapter, nothing has been
+        # sent then. A connection dropped after the request went out (a stale
+        # keep-alive connection) may have created the episode already.
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=BUZZSPROUT_POOL_SIZE,
+            max_retries=Retry(total=None, connect=BUZZSPROUT_MAX_RETRIES, read=0, status=0, other=0, redirect=0,
+                              backoff_factor=BUZZSPROUT_BACKOFF)
+        ))
+        self.session.headers.update({
+            'Authorization': f'Token token={api_key}',
+            'Content-Type': 'application/json',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        })
+
+    def create_episode(self, title, description, audio_url):
+        url = f'https://www.buzzsprout.com/api/{self.podcast_id}/episodes'
+        data = {
+            'title': title,
+            'description': description,
+            'audio_url': audio_url
+        }
+        response = self.request('POST', url, json=data)
+        if response.status_code == 201:
+            logging.info(f"Episode '{title}' uploaded successfully to Buzzsprout.")
+            return response.json().get('id')
+        else:
+            logging.info(f"Failed to upload episode '{title}' to Buzzsprout: {response.content}")
+            return None
+
+    def request(self, method, url, **kwargs):
+        # 429 and 503 are retried after Retry-After or an exponential backoff,
+        # never waiting longer than BUZZSPROUT_MAX_BACKOFF. Network failures
+        # are left to the adapter, which only retries connecting.
+        attempt = 0
+        while True:
+            response = self.session.request(method, url, timeout=(BUZZSPROUT_CONNECT_TIMEOUT, BUZZSPROUT_READ_TIMEOUT), **kwargs)
+            if response.status_code not in BUZZSPROUT_RETRY_STATUSES:
+                return response
+            if attempt >= BUZZSPROUT_MAX_RETRIES:
+                return response
+            delay = retry_after(response)
+            if delay is None:
+                delay = BUZZSPROUT_BACKOFF * 2 ** attempt
+            delay = min(delay, BUZZSPROUT_MAX_BACKOFF)
+            logging.info(f"Buzzsprout answered {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+# One client per set of credentials in each worker process, so every publish
+# for a podcast goes over the same keep-alive session
+buzzsprout_clients = {}
+buzzsprout_clients_lock = threading.Lock()
+
+def get_buzzsprout_client(api_key, podcast_id):
+    with buzzsprout_clients_lock:
+        client = buzzsprout_clients.get((api_key, podcast_id))
+        if client is None:
+            logging.info(f"Using Buzzsprout Podcast ID: {podcast_id}")
+            client = buzzsprout_clients[(api_key, podcast_id)] = BuzzsproutClient(api_key, podcast_id)
+        return client
@@ -0,0 +1,102 @@
+import os
+import time
+import socket
+import logging
+from dotenv import load_dotenv
+from downloader import download_stream
+from store import redis_client
+
+load_dotenv()
+
+# Shared download cache: source audio is kept once per (video ID, itag) for
+# every podcast and job on this host. Entries in use by a job are never
+# evicted, the rest are dropped least recently used first once the cache
+# grows past DOWNLOAD_CACHE_BYTES.
+DOWNLOAD_CACHE_DIR = os.getenv('DOWNLOAD_CACHE_DIR', os.path.join('downloaded', 'cache'))
+DOWNLOAD_CACHE_BYTES = int(os.getenv('DOWNLOAD_CACHE_BYTES', 10 * 1024 * 1024 * 1024))
+# How long a download may hold its entry's lock, and how long others wait on it
+DOWNLOAD_CACHE_LOCK_TIMEOUT = int(os.getenv('DOWNLOAD_CACHE_LOCK_TIMEOUT', 60 * 60))
+DOWNLOAD_CACHE_REF_TTL = int(os.getenv('DOWNLOAD_CACHE_REF_TTL', 7 * 24 * 60 * 60))
+
+# The files are on this host's disk, so its Redis bookkeeping is kept apart
+# from other hosts' under the host name
+CACHE_HOST = socket.gethostname()
+CACHE_SIZES_KEY = f'download_cache_sizes:{CACHE_HOST}'
+CACHE_LRU_KEY = f'download_cache_lru:{CACHE_HOST}'
+# Downloads that haven't finished: their preallocated file and ranges sidecar
+# are kept for a retry to resume, and count against the cache until evicted
+CACHE_PARTIAL_KEY = f'download_cache_partial:{CACHE_HOST}'
+
+
+def cache_entry(video_id, stream):
+    return f"{video_id}:{stream.itag}"
+
+def cache_prefix(entry):
+    # Video IDs may contain dashes but never dots
+    return entry.replace(':', '.') + '.'
+
+def refs_key(entry):
+    return f"download_cache_refs:{CACHE_HOST}:{entry}"
+
+def entry_lock(entry, blocking=True):
+    return redis_client.lock(f"download_cache_lock:{CACHE_HOST}:{entry}", timeout=DOWNLOAD_CACHE_LOCK_TIMEOUT,
+                             blocking=blocking, blocking_timeout=DOWNLOAD_CACHE_LOCK_TIMEOUT)
+
+def acquire_cached_audio(video_id, stream, owner):
+    # Returns the cached file for the stream, downloading it first if needed.
+    # The entry's lock makes the download single-flight: a second worker asking
+    # for the same stream waits on the lock and then finds the finished file.
+    # References are kept per owner so a redelivered task takes its own back.
+    entry = cache_entry(video_id, stream)
+    file_path = os.path.join(DOWNLOAD_CACHE_DIR, cache_prefix(entry) + stream.subtype)
+    os.makedirs(DOWNLOAD_CACHE_DIR, exist_ok=True)
+    with entry_lock(entry):
+        if redis_client.hexists(CACHE_SIZES_KEY, entry) and os.path.exists(file_path):
+            logging.info(f"Using cached audio {file_path}")
+        else:
+            redis_client.hset(CACHE_PARTIAL_KEY, entry, stream.filesize)
+            redis_client.zadd(CACHE_LRU_KEY, {entry: time.time()})
+            download_stream(stream, file_path)
+            redis_client.hset(CACHE_SIZES_KEY, entry, os.path.getsize(file_path))
+            redis_client.hdel(CACHE_PARTIAL_KEY, entry)
+        refs = refs_key(entry)
+        redis_client.sadd(refs, owner)
+        redis_client.expire(refs, DOWNLOAD_CACHE_REF_TTL)
+        redis_client.zadd(CACHE_LRU_KEY, {entry: time.time()})
+    evict_cached_audio()
+    return entry, file_path
+
+def release_cached_audio(entry, owner):
+    redis_client.srem(refs_key(entry), owner)
+    redis_client.zadd(CACHE_LRU_KEY, {entry: time.time()})
+
+def evict_cached_audio():
+    sizes = {
+        entry.decode('utf-8'): int(size)
+        for key in (CACHE_PARTIAL_KEY, CACHE_SIZES_KEY)
+        for entry, size in redis_client.hgetall(key).items()
+    }
+    total = sum(sizes.values())
+    if total <= DOWNLOAD_CACHE_BYTES:
+        return
+    for entry in redis_client.zrange(CACHE_LRU_KEY, 0, -1):
+        if total <= DOWNLOAD_CACHE_BYTES:
+            break
+        entry = entry.decode('utf-8')
+        # Entries being downloaded or checked by another worker are skipped
+        lock = entry_lock(entry, blocking=False)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            if redis_client.scard(refs_key(entry)):
+                continue
+            for name in os.listdir(DOWNLOAD_CACHE_DIR):
+                if name.startswith(cache_prefix(entry)):
+                    os.remove(os.path.join(DOWNLOAD_CACHE_DIR, name))
+            redis_client.hdel(CACHE_SIZES_KEY, entry)
+            redis_client.hdel(CACHE_PARTIAL_KEY, entry)
+            redis_client.zrem(CACHE_LRU_KEY, entry)
+            total -= sizes.get(entry, 0)
+            logging.info(f"Evicted cached audio {entry}")
+        finally:
+            lock.release()
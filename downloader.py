@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import logging
+import threading
+import requests
+from dotenv import load_dotenv
+from transport import HEADERS, get_session
+
+load_dotenv()
+
+# Parallel ranged downloads: number of connections per file, the bounds for a
+# single range, how long one range should take at the measured throughput and
+# how long a connection may stall before its range is retried
+DOWNLOAD_CONNECTIONS = int(os.getenv('DOWNLOAD_CONNECTIONS', 4))
+MIN_RANGE_SIZE = int(os.getenv('DOWNLOAD_MIN_RANGE_SIZE', 512 * 1024))
+MAX_RANGE_SIZE = int(os.getenv('DOWNLOAD_MAX_RANGE_SIZE', 16 * 1024 * 1024))
+TARGET_RANGE_SECONDS = float(os.getenv('DOWNLOAD_TARGET_RANGE_SECONDS', 3))
+STALL_TIMEOUT = float(os.getenv('DOWNLOAD_STALL_TIMEOUT', 15))
+MAX_RANGE_RETRIES = int(os.getenv('DOWNLOAD_MAX_RANGE_RETRIES', 5))
+READ_SIZE = 64 * 1024
+
+
+def missing_ranges(filesize, completed):
+    gaps = []
+    position = 0
+    for start, end in sorted(completed):
+        if start > position:
+            gaps.append((position, start - 1))
+        position = max(position, end + 1)
+    if position < filesize:
+        gaps.append((position, filesize - 1))
+    return gaps
+
+
+class RangeScheduler:
+    # Hands out the next byte range to whichever connection is free, sized so
+    # that it takes about TARGET_RANGE_SECONDS at the throughput seen so far.
+    # Finished ranges are written to a sidecar file so an interrupted download
+    # can pick up only the bytes it is still missing.
+    def __init__(self, filesize, ranges_path, completed=()):
+        self.filesize = filesize
+        self.ranges_path = ranges_path
+        self.completed = list(completed)
+        self.gaps = missing_ranges(filesize, self.completed)
+        self.rate = None
+        self.lock = threading.Lock()
+
+    def next_range(self):
+        with self.lock:
+            if not self.gaps:
+                return None
+            if self.rate is None:
+                size = MIN_RANGE_SIZE
+            else:
+                size = int(self.rate * TARGET_RANGE_SECONDS)
+            size = max(MIN_RANGE_SIZE, min(MAX_RANGE_SIZE, size))
+            start, gap_end = self.gaps[0]
+            end = min(start + size - 1, gap_end)
+            if end == gap_end:
+                self.gaps.pop(0)
+            else:
+                self.gaps[0] = (end + 1, gap_end)
+            return start, end
+
+    def complete(self, start, end):
+        with self.lock:
+            self.completed.append((start, end))
+            with open(self.ranges_path, 'w') as f:
+                json.dump(self.completed, f)
+
+    def record(self, nbytes, seconds):
+        if seconds <= 0:
+            return
+        with self.lock:
+            # Per-connection throughput, smoothed over recent ranges
+            rate = nbytes / seconds
+            self.rate = rate if self.rate is None else 0.7 * self.rate + 0.3 * rate
+
+
+def fetch_range(session, url, file_path, start, end, scheduler):
+    position = start
+    tries = 0
+    with open(file_path, 'r+b') as f:
+        try:
+            while position <= end:
+                began = time.monotonic()
+                received = 0
+                try:
+                    response = session.get(url + f"&range={position}-{end}", headers=HEADERS, stream=True, timeout=(10, STALL_TIMEOUT))
+                    response.raise_for_status()
+                    f.seek(position)
+                    for chunk in response.iter_content(READ_SIZE):
+                        chunk = chunk[:end - position + 1]
+                        f.write(chunk)
+                        position += len(chunk)
+                        received += len(chunk)
+                        if position > end:
+                            break
+                except (requests.ConnectionError, requests.Timeout, requests.HTTPError, requests.exceptions.ChunkedEncodingError) as e:
+                    tries += 1
+                    if tries > MAX_RANGE_RETRIES:
+                        raise
+                    logging.info(f"Retrying range {position}-{end} after error: {e}")
+                    time.sleep(min(2 ** tries, 30))
+                    continue
+                finally:
+                    scheduler.record(received, time.monotonic() - began)
+
+                if received == 0:
+                    tries += 1
+                    if tries > MAX_RANGE_RETRIES:
+                        raise IOError(f"Range {position}-{end} returned no data")
+        finally:
+            # Whatever made it to disk counts, even if the range gave up part way
+            f.flush()
+            if position > start:
+                scheduler.complete(start, position - 1)
+
+
+def load_completed_ranges(file_path, ranges_path, filesize):
+    if not os.path.exists(ranges_path) or not os.path.exists(file_path) or os.path.getsize(file_path) != filesize:
+        return None
+    try:
+        with open(ranges_path) as f:
+            return [tuple(byte_range) for byte_range in json.load(f)]
+    except ValueError:
+        return None
+
+
+def download_stream(stream, file_path, connections=DOWNLOAD_CONNECTIONS):
+    filesize = stream.filesize
+    if not filesize:
+        # Without a known size we can't split the file, use pytube's own download
+        output_path, filename = os.path.split(file_path)
+        return stream.download(output_path=output_path, filename=filename)
+
+    ranges_path = file_path + '.ranges'
+    completed = load_completed_ranges(file_path, ranges_path, filesize)
+    if completed is None:
+        # Preallocate the whole file so every connection can write its ranges in place
+        with open(file_path, 'wb') as f:
+            f.truncate(filesize)
+        completed = []
+    else:
+        logging.info(f"Resuming download of {file_path} with {sum(end - start + 1 for start, end in completed)} of {filesize} bytes already on disk")
+
+    scheduler = RangeScheduler(filesize, ranges_path, completed)
+    errors = []
+    # Ranges share the worker's pooled connections, so they reuse warm TLS sessions
+    session = get_session()
+    began = time.monotonic()
+
+    def worker():
+        while not errors:
+            byte_range = scheduler.next_range()
+            if byte_range is None:
+                return
+            try:
+                fetch_range(session, stream.url, file_path, byte_range[0], byte_range[1], scheduler)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, connections))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # On failure the partial file and its sidecar stay behind for the next attempt
+    if errors:
+        raise errors[0]
+    os.remove(ranges_path)
+
+    elapsed = time.monotonic() - began
+    logging.info(f"Downloaded {filesize} bytes to {file_path} in {elapsed:.1f}s over {connections} connections")
+    return file_path
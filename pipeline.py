@@ -0,0 +1,92 @@
+import logging
+import queue
+import threading
+
+# Marks the end of the input for one worker of a stage
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+
+
+class Pipeline:
+    # Runs items through a chain of stages, each with its own worker pool and
+    # bounded input queue. A full queue blocks the stage in front of it, so a
+    # slow stage throttles the ones feeding it instead of piling up work.
+    # A stage returning None drops the item, an exception drops it too after
+    # being handed to on_error, the other items keep flowing.
+    def __init__(self, stages, queue_size=2, on_error=None):
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self.on_error = on_error
+
+    def run(self, items):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = []
+        results_lock = threading.Lock()
+        threads = []
+
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            remaining_lock = threading.Lock()
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(index, stage, queues, remaining, remaining_lock, results, results_lock),
+                    name=f"pipeline-{stage.name}-{worker}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        return results
+
+    def _work(self, index, stage, queues, remaining, remaining_lock, results, results_lock):
+        is_last = index == len(self.stages) - 1
+        try:
+            while True:
+                item = queues[index].get()
+                if item is _DONE:
+                    break
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    self._handle_error(stage, item, e)
+                    continue
+                if result is None:
+                    continue
+                if is_last:
+                    with results_lock:
+                        results.append(result)
+                else:
+                    queues[index + 1].put(result)
+        finally:
+            # The last worker out of a stage closes the next stage's input,
+            # even if this one is dying, so run never waits on a stage forever
+            with remaining_lock:
+                remaining[0] -= 1
+                closing = remaining[0] == 0
+            if closing and not is_last:
+                for _ in range(self.stages[index + 1].workers):
+                    queues[index + 1].put(_DONE)
+
+    def _handle_error(self, stage, item, error):
+        if not self.on_error:
+            logging.info(f"Pipeline stage '{stage.name}' failed: {error}")
+            return
+        # A failing error handler must not take the worker down with it
+        try:
+            self.on_error(item, error)
+        except Exception as e:
+            logging.error(f"Pipeline stage '{stage.name}' failed: {error}, and handling it failed: {e}")
@@ -0,0 +1,85 @@
+import os
+import re
+import copy
+import time
+import logging
+import threading
+from pytube import YouTube, extract, request
+from pytube.cipher import Cipher
+from pytube.exceptions import ExtractError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# YouTube's player script (base.js) and the Cipher parsed from it are the same
+# for every video served by one player version, so each worker process keeps
+# them per version for PLAYER_CACHE_TTL seconds instead of fetching and
+# parsing them again for every video
+PLAYER_CACHE_TTL = int(os.getenv('PLAYER_CACHE_TTL', 6 * 60 * 60))
+
+players = {}
+ciphers = {}
+players_lock = threading.Lock()
+original_apply_signature = extract.apply_signature
+
+
+def player_version(js_url):
+    match = re.search(r'/s/player/([\w-]+)/', js_url)
+    return match.group(1) if match else js_url
+
+def drop_expired_players():
+    # Called with players_lock held. Old player versions are never asked for
+    # again, so they are dropped here rather than when next requested.
+    now = time.monotonic()
+    for version, entry in list(players.items()):
+        if now - entry['fetched_at'] >= PLAYER_CACHE_TTL:
+            ciphers.pop(entry['js'], None)
+            del players[version]
+
+def get_player_js(js_url):
+    version = player_version(js_url)
+    with players_lock:
+        drop_expired_players()
+        entry = players.get(version)
+        if entry:
+            return entry['js']
+        # Fetched under the lock so concurrent videos wait for one download
+        js = request.get(js_url)
+        players[version] = {'js': js, 'fetched_at': time.monotonic()}
+        logging.info(f"Cached player {version}")
+        return js
+
+def get_cipher(js):
+    # The js text of a cached player is the same object every time, so the
+    # lookup compares identity and reuses the string's cached hash
+    with players_lock:
+        cipher = ciphers.get(js)
+        if cipher is None:
+            cipher = ciphers[js] = Cipher(js=js)
+    # calculate_n writes the video's n into the throttling array and
+    # remembers the result, so each video gets its own copy of that state
+    video_cipher = copy.copy(cipher)
+    video_cipher.throttling_array = copy.deepcopy(cipher.throttling_array)
+    video_cipher.calculated_n = None
+    return video_cipher
+
+def forget_player(js):
+    with players_lock:
+        ciphers.pop(js, None)
+        for version, entry in list(players.items()):
+            if entry['js'] is js:
+                del players[version]
+
+def apply_signature(stream_manifest, vid_info, js):
+    # pytube retries with a fresh player when deciphering fails, which only
+    # works if the cached one is dropped first
+    try:
+        return original_apply_signature(stream_manifest, vid_info, js)
+    except ExtractError:
+        forget_player(js)
+        raise
+
+def install_player_cache():
+    YouTube.js = property(lambda yt: get_player_js(yt.js_url))
+    extract.Cipher = get_cipher
+    extract.apply_signature = apply_signature
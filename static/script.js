@@ -3,6 +3,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const startButton = document.getElementById('start-conversion-btn');
     const stopButton = document.getElementById('stop-conversion-btn');
     const statusUpdatesDiv = document.getElementById('status-updates');
+    let currentTaskId = null;
 
     // Socket.IO connection
     const socket = io();
@@ -29,6 +30,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const maxDurationMinutes = document.getElementById('max-duration-minutes').value;
         const maxDurationSeconds = document.getElementById('max-duration-seconds').value;
         const titleFilter = document.getElementById('title-filter').value;
+        const encodingProfile = document.getElementById('encoding-profile').value;
 
         const requestBody = {
             url: url,
@@ -38,7 +40,8 @@ document.addEventListener('DOMContentLoaded', function() {
             min_duration_seconds: minDurationSeconds || 0,
             max_duration_minutes: maxDurationMinutes || 0,
             max_duration_seconds: maxDurationSeconds || 0,
-            title_filter: titleFilter || ''
+            title_filter: titleFilter || '',
+            encoding_profile: encodingProfile
         };
 
         fetch('/start-conversion', {
@@ -57,6 +60,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             if (data.status === 'started') {
                 alert('Conversion started');
+                currentTaskId = data.task_id;
                 stopButton.style.display = 'block';
             } else {
                 alert('Error: ' + data.message);
@@ -73,7 +77,8 @@ document.addEventListener('DOMContentLoaded', function() {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
-            }
+            },
+            body: JSON.stringify({ task_id: currentTaskId })
         })
         .then(response => {
             if (!response.ok) {
@@ -84,6 +89,7 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             if (data.status === 'stopped') {
                 alert('Conversion stopped');
+                currentTaskId = null;
                 stopButton.style.display = 'none';
             } else {
                 alert('Error: ' + data.message);
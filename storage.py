@@ -0,0 +1,219 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Multipart transfer tuning: files above the threshold are split into parts
+# uploaded S3_MAX_CONCURRENCY at a time. The connection pool is sized so every
+# upload stage worker can run that many parts at once.
+S3_MULTIPART_THRESHOLD = int(os.getenv('S3_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+S3_PART_SIZE = max(int(os.getenv('S3_PART_SIZE', 16 * 1024 * 1024)), 5 * 1024 * 1024)
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', 8))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', S3_MAX_CONCURRENCY * int(os.getenv('PIPELINE_UPLOAD_WORKERS', 2))))
+# Percentage steps at which upload progress is reported
+S3_PROGRESS_STEP = int(os.getenv('S3_PROGRESS_STEP', 25))
+
+transfer_config = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    multipart_chunksize=S3_PART_SIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    use_threads=True
+)
+
+# AWS S3 setup, created on first use and shared by every thread in the process
+s3 = None
+s3_lock = threading.Lock()
+
+def bucket_region():
+    # Presigned URLs are signed for one region, taken from the environment or
+    # else asked of the bucket itself (no LocationConstraint means us-east-1)
+    region = os.getenv('AWS_REGION') or os.getenv('AWS_DEFAULT_REGION')
+    if region or not os.getenv('AWS_BUCKET_NAME'):
+        return region
+    location = boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        config=Config(signature_version='s3v4')
+    ).get_bucket_location(Bucket=os.getenv('AWS_BUCKET_NAME'))
+    return location.get('LocationConstraint') or 'us-east-1'
+
+def get_s3():
+    global s3
+    with s3_lock:
+        if s3 is None:
+            # SigV4 throughout, newer buckets and regions reject SigV2 presigned URLs
+            s3 = boto3.client(
+                's3',
+                region_name=bucket_region(),
+                aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                config=Config(
+                    signature_version='s3v4',
+                    s3={'addressing_style': 'virtual'},
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    retries={'mode': 'adaptive'}
+                )
+            )
+        return s3
+
+
+class TransferProgress:
+    # Byte-level callback for boto3 transfers. Called from several threads at
+    # once, it passes progress on every S3_PROGRESS_STEP percent.
+    def __init__(self, total, on_progress=None):
+        self.total = total
+        self.on_progress = on_progress
+        self.sent = 0
+        self.reported = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        with self.lock:
+            self.sent += bytes_amount
+            if not self.on_progress or not self.total:
+                return
+            percent = min(100, self.sent * 100 // self.total)
+            if percent - self.reported < S3_PROGRESS_STEP and percent < 100:
+                return
+            if percent == self.reported:
+                return
+            self.reported = percent
+        self.on_progress(percent)
+
+
+class TransferStats:
+    # Aggregate upload throughput for this worker process
+    def __init__(self):
+        self.uploads = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, s3_key, nbytes, seconds):
+        with self.lock:
+            self.uploads += 1
+            self.bytes += nbytes
+            self.seconds += seconds
+            average = self.bytes / self.seconds if self.seconds else 0
+        rate = nbytes / seconds if seconds else 0
+        logging.info(f"Uploaded {s3_key}: {nbytes} bytes in {seconds:.1f}s ({rate / 1024 / 1024:.1f} MB/s), "
+                     f"{self.uploads} uploads averaging {average / 1024 / 1024:.1f} MB/s")
+
+
+transfer_stats = TransferStats()
+
+# Audio URLs handed to Buzzsprout: a CDN base if configured, otherwise a
+# presigned GET (the SigV4 maximum is 7 days) so the bucket can stay private,
+# or the plain public object URL when AUDIO_URL_MODE is "public"
+AUDIO_CDN_BASE_URL = os.getenv('AUDIO_CDN_BASE_URL', '').rstrip('/')
+AUDIO_URL_MODE = os.getenv('AUDIO_URL_MODE', 'presigned')
+AUDIO_URL_EXPIRY = min(int(os.getenv('AUDIO_URL_EXPIRY', 7 * 24 * 60 * 60)), 7 * 24 * 60 * 60)
+
+def audio_url(bucket_name, s3_key):
+    if AUDIO_CDN_BASE_URL:
+        return f'{AUDIO_CDN_BASE_URL}/{s3_key}'
+    if AUDIO_URL_MODE == 'public':
+        return f'https://{bucket_name}.s3.amazonaws.com/{s3_key}'
+    return get_s3().generate_presigned_url('get_object', Params={'Bucket': bucket_name, 'Key': s3_key}, ExpiresIn=AUDIO_URL_EXPIRY)
+
+# Episode audio is stored content-addressed as <prefix>/<video ID>/<hash>.<ext>,
+# or <prefix>/<video ID>/<profile>/<hash>.<ext> for encoding profiles other
+# than the default, so different videos never collide and identical bytes map
+# to one object
+S3_PREFIX = os.getenv('S3_PREFIX', 'podcasts')
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def content_key(video_id, digest, extension='mp3', profile='default'):
+    if profile == 'default':
+        return f'{S3_PREFIX}/{video_id}/{digest[:16]}.{extension}'
+    return f'{S3_PREFIX}/{video_id}/{profile}/{digest[:16]}.{extension}'
+
+def object_name(video_id, profile='default'):
+    # How a stored episode is named in the object index
+    return video_id if profile == 'default' else f'{video_id}:{profile}'
+
+def list_audio_objects(bucket_name):
+    # One paginated ListObjectsV2 over the whole prefix, yields (object name, key)
+    paginator = get_s3().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f'{S3_PREFIX}/'):
+        for item in page.get('Contents', []):
+            parts = item['Key'].split('/')
+            if len(parts) == 3:
+                yield object_name(parts[1]), item['Key']
+            elif len(parts) == 4:
+                yield object_name(parts[1], parts[2]), item['Key']
+
+def upload_to_s3(file_path, bucket_name, s3_key, on_progress=None, content_type=None):
+    # upload_file raises unless S3 confirmed every part, so the object is
+    # known to exist and no probe is needed before publishing
+    size = os.path.getsize(file_path)
+    began = time.monotonic()
+    extra_args = {'ContentType': content_type} if content_type else None
+    get_s3().upload_file(file_path, bucket_name, s3_key, ExtraArgs=extra_args, Config=transfer_config, Callback=TransferProgress(size, on_progress))
+    transfer_stats.record(s3_key, size, time.monotonic() - began)
+    return audio_url(bucket_name, s3_key)
+
+# Streaming uploads: part size (S3 minimum is 5 MB) and how many parts may be
+# buffered in memory or in flight at once
+STREAM_UPLOADS = os.getenv('STREAM_UPLOADS', '').lower() in ('1', 'true', 'yes')
+STREAM_PART_SIZE = max(int(os.getenv('STREAM_PART_SIZE', 8 * 1024 * 1024)), 5 * 1024 * 1024)
+STREAM_BUFFER_PARTS = int(os.getenv('STREAM_BUFFER_PARTS', 4))
+
+def stream_to_s3(chunks, bucket_name, s3_key, total=None, on_progress=None, content_type=None):
+    s3 = get_s3()
+    extra_args = {'ContentType': content_type} if content_type else {}
+    upload_id = s3.create_multipart_upload(Bucket=bucket_name, Key=s3_key, **extra_args)['UploadId']
+    slots = threading.BoundedSemaphore(STREAM_BUFFER_PARTS)
+    progress = TransferProgress(total, on_progress)
+    futures = []
+    began = time.monotonic()
+
+    def upload_part(part_number, body):
+        try:
+            response = s3.upload_part(Bucket=bucket_name, Key=s3_key, UploadId=upload_id, PartNumber=part_number, Body=body)
+            progress(len(body))
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            slots.release()
+
+    def submit_part(executor, body):
+        # Blocks the reader while the buffer is full so memory stays bounded
+        slots.acquire()
+        futures.append(executor.submit(upload_part, len(futures) + 1, body))
+
+    try:
+        with ThreadPoolExecutor(max_workers=STREAM_BUFFER_PARTS) as executor:
+            buffer = bytearray()
+            for chunk in chunks:
+                buffer.extend(chunk)
+                while len(buffer) >= STREAM_PART_SIZE:
+                    submit_part(executor, bytes(buffer[:STREAM_PART_SIZE]))
+                    del buffer[:STREAM_PART_SIZE]
+            if buffer or not futures:
+                submit_part(executor, bytes(buffer))
+            parts = [future.result() for future in futures]
+
+        response = s3.complete_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id, MultipartUpload={'Parts': parts})
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+        raise
+
+    if not response.get('ETag'):
+        raise IOError(f"Multipart upload of {s3_key} was not confirmed by S3")
+    transfer_stats.record(s3_key, progress.sent, time.monotonic() - began)
+    return audio_url(bucket_name, s3_key)
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import redis
+from googleapiclient.errors import HttpError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Redis client
+redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
+
+# Video metadata cache: one key per video, expiring VIDEO_METADATA_TTL
+# seconds after it was fetched, so a whole API page is a single MGET and
+# videos nobody asks about again don't stay in Redis
+VIDEO_METADATA_TTL = int(os.getenv('VIDEO_METADATA_TTL', 24 * 60 * 60))
+
+def get_cached_videos(video_ids):
+    if not video_ids:
+        return {}
+    cached = {}
+    for video_id, value in zip(video_ids, redis_client.mget([f"video_metadata:{video_id}" for video_id in video_ids])):
+        if value is not None:
+            cached[video_id] = json.loads(value)
+    return cached
+
+def cache_videos(details_by_id):
+    if not details_by_id:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for video_id, details in details_by_id.items():
+        pipe.set(f"video_metadata:{video_id}", json.dumps(details), ex=VIDEO_METADATA_TTL)
+    pipe.execute()
+
+# Playlist pages revalidated by ETag, one key per page so each expires on its
+# own once it hasn't been fetched for API_PAGE_TTL seconds
+API_PAGE_TTL = int(os.getenv('API_PAGE_TTL', 7 * 24 * 60 * 60))
+
+def execute_conditional(request, cache_key):
+    # Revalidates a YouTube API request against the last response's ETag, an
+    # unchanged resource answers 304 and the stored body is reused
+    key = f"youtube_api_page:{cache_key}"
+    cached = redis_client.get(key)
+    if cached:
+        cached = json.loads(cached)
+        request.headers['If-None-Match'] = cached['etag']
+    try:
+        response = request.execute()
+    except HttpError as e:
+        if cached and e.resp.status == 304:
+            redis_client.expire(key, API_PAGE_TTL)
+            return cached['body']
+        raise
+    if response.get('etag'):
+        redis_client.set(key, json.dumps({'etag': response['etag'], 'body': response}), ex=API_PAGE_TTL)
+    return response
+
+# Sync marks: per (source, podcast) the publish time of the newest video a job
+# has fully handled, so re-syncs only page through what was added since
+SYNC_MARKS_KEY = 'sync_marks'
+
+def get_sync_mark(source_id, podcast_id):
+    mark = redis_client.hget(SYNC_MARKS_KEY, f"{source_id}:{podcast_id}")
+    return mark.decode('utf-8') if mark else None
+
+def set_sync_mark(source_id, podcast_id, mark):
+    redis_client.hset(SYNC_MARKS_KEY, f"{source_id}:{podcast_id}", mark)
+
+# Publish ledger: one hash per podcast mapping video ID to its S3 key,
+# Buzzsprout episode ID and state ("uploaded" or "published"), so a re-run
+# never downloads or publishes the same video twice
+def ledger_key(podcast_id):
+    return f"publish_ledger:{podcast_id}"
+
+def get_ledger_entries(podcast_id, video_ids):
+    if not video_ids:
+        return {}
+    values = redis_client.hmget(ledger_key(podcast_id), video_ids)
+    return {video_id: json.loads(value) for video_id, value in zip(video_ids, values) if value}
+
+def get_ledger_entry(podcast_id, video_id):
+    value = redis_client.hget(ledger_key(podcast_id), video_id)
+    return json.loads(value) if value else {}
+
+def record_ledger_entry(podcast_id, video_id, state, **fields):
+    entry = get_ledger_entry(podcast_id, video_id)
+    entry.update(fields, state=state, updated_at=time.time())
+    redis_client.hset(ledger_key(podcast_id), video_id, json.dumps(entry))
+
+# Job checkpoints: the arguments each job was started with, so it can be run
+# again under its own ID. Its videos then pick up from the publish ledger, the
+# S3 object index and the download cache.
+JOB_STATE_TTL = int(os.getenv('JOB_STATE_TTL', 7 * 24 * 60 * 60))
+
+def save_job(job_id, kind, args):
+    redis_client.set(f"job:{job_id}", json.dumps({'kind': kind, 'args': args}), ex=JOB_STATE_TTL)
+
+def load_job(job_id):
+    value = redis_client.get(f"job:{job_id}")
+    return json.loads(value) if value else None
+
+# Jobs are stopped with a flag rather than by revoking their tasks, as chunks
+# still waiting in the queue have IDs nobody knows. Every chunk and video
+# checks it before starting work. Each run of a job (a redelivered or resumed
+# parent starts a new one) has its own run ID, and only the job's latest run
+# goes on working, so two runs never process the same job's videos.
+ACTIVE_JOBS_KEY = 'active_jobs'
+
+def start_job(job_id, run_id):
+    redis_client.sadd(ACTIVE_JOBS_KEY, job_id)
+    redis_client.set(f"job_run:{job_id}", run_id, ex=JOB_STATE_TTL)
+
+def finish_job(job_id, run_id):
+    # A superseded run finishing leaves the job to the run that replaced it
+    if redis_client.get(f"job_run:{job_id}") != run_id.encode('utf-8'):
+        return
+    redis_client.srem(ACTIVE_JOBS_KEY, job_id)
+    redis_client.delete(f"job_cancelled:{job_id}", f"job_run:{job_id}")
+
+def get_active_jobs():
+    return [job_id.decode('utf-8') for job_id in redis_client.smembers(ACTIVE_JOBS_KEY)]
+
+def is_job_active(job_id):
+    return bool(redis_client.sismember(ACTIVE_JOBS_KEY, job_id))
+
+def cancel_job(job_id):
+    redis_client.set(f"job_cancelled:{job_id}", 1, ex=JOB_STATE_TTL)
+
+def clear_job_cancel(job_id):
+    redis_client.delete(f"job_cancelled:{job_id}")
+
+def is_job_cancelled(job_id):
+    return bool(redis_client.exists(f"job_cancelled:{job_id}"))
+
+def is_run_stopped(job_id, run_id):
+    # The job was stopped or a later run of it has taken over
+    cancelled, current = redis_client.pipeline().exists(f"job_cancelled:{job_id}").get(f"job_run:{job_id}").execute()
+    return bool(cancelled) or current != run_id.encode('utf-8')
+
+# Claims are owned by one run of a job, so a redelivered chunk takes its own
+# claims back, while a video still held by an earlier run of the same job is
+# left alone until that run releases it or the claim expires
+def claim_video(podcast_id, video_id, owner, ttl):
+    key = f"video_claim:{podcast_id}:{video_id}"
+    if redis_client.set(key, owner, nx=True, ex=ttl):
+        return True
+    return redis_client.get(key) == owner.encode('utf-8')
+
+def release_video(podcast_id, video_id, owner):
+    key = f"video_claim:{podcast_id}:{video_id}"
+    if redis_client.get(key) == owner.encode('utf-8'):
+        redis_client.delete(key)
+
+# Index of the episode audio stored in S3, video ID to object key, rebuilt from
+# one ListObjectsV2 pass per job so checking for a stored copy needs no HEAD
+def object_index_key(bucket_name):
+    return f"s3_objects:{bucket_name}"
+
+def replace_object_index(bucket_name, objects):
+    key = object_index_key(bucket_name)
+    pipe = redis_client.pipeline()
+    pipe.delete(f"{key}:building")
+    if objects:
+        pipe.hset(f"{key}:building", mapping=objects)
+        pipe.rename(f"{key}:building", key)
+    else:
+        pipe.delete(key)
+    pipe.execute()
+
+def get_indexed_object(bucket_name, video_id):
+    s3_key = redis_client.hget(object_index_key(bucket_name), video_id)
+    return s3_key.decode('utf-8') if s3_key else None
+
+def add_indexed_object(bucket_name, video_id, s3_key):
+    redis_client.hset(object_index_key(bucket_name), video_id, s3_key)
@@ -1,151 +1,183 @@
 import os
 import re
-import requests
-import certifi
-import ssl
-import urllib.request
+import urllib.parse
 from pytube import YouTube, Channel, Playlist, request
-import boto3
-from googleapiclient.discovery import build
-from celery import Celery
-from dotenv import load_dotenv
+import json
+import hashlib
+import uuid
+import httplib2
+from contextlib import contextmanager
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from celery import Celery, chord, group
+from dotenv import load_dotenv, dotenv_values
 import logging
+import threading
+import isodate
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 import redis
 from flask_socketio import SocketIO, emit
+from pipeline import Pipeline, Stage
+from player import install_player_cache
+from transport import install_transport, get_session
+from cache import acquire_cached_audio, release_cached_audio
+from transcoder import AUDIO_FORMATS, TRANSCODE_WORKERS, select_audio_stream, conversion_plan, plan_encoding, transcode_file, transcode_stream
+from storage import STREAM_UPLOADS, TransferProgress, audio_url, upload_to_s3, stream_to_s3, file_digest, content_key, object_name, list_audio_objects
+from buzzsprout import get_buzzsprout_client
+from store import get_cached_videos, cache_videos, execute_conditional, get_sync_mark, set_sync_mark, get_ledger_entries, get_ledger_entry, record_ledger_entry, save_job, load_job, start_job, finish_job, is_job_active, clear_job_cancel, is_job_cancelled, is_run_stopped, claim_video, release_video, replace_object_index, get_indexed_object, add_indexed_object
 
 load_dotenv()
 
 celery_app = Celery('tasks', broker='redis://localhost:6379/0', backend='redis://localhost:6379/0')
+# Late-acked tasks are redelivered once this expires, so it has to outlast the longest chunk
+celery_app.conf.broker_transport_options = {'visibility_timeout': int(os.getenv('CELERY_VISIBILITY_TIMEOUT', 6 * 60 * 60))}
 
 # Redis client
 redis_client = redis.StrictRedis(host='localhost', port=6379, db=0)
 
-# SSL context for requests
-ssl_context = ssl.create_default_context(cafile=certifi.where())
-
 # Setup logging
 logging.basicConfig(filename='logfile.log', level=logging.INFO, format='%(message)s')
 
 socketio = SocketIO(message_queue='redis://localhost:6379/0')
 
-# Custom get function for pytube
-def custom_get(url, headers=None, timeout=None):
-    if headers is None:
-        headers = {}
-    req = urllib.request.Request(url, headers=headers)
-    with urllib.request.urlopen(req, context=ssl_context, timeout=timeout) as response:
-        return response.read().decode('utf-8')
-
-# Patch pytube's request handling
-request.get = custom_get
-
-# AWS S3 setup
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
-)
-
-def upload_to_s3(file_path, bucket_name, s3_key):
-    s3.upload_file(file_path, bucket_name, s3_key)
-    s3_url = f'https://{bucket_name}.s3.amazonaws.com/{s3_key}'
-    return s3_url
-
-def is_url_accessible(url):
-    try:
-        response = requests.head(url)
-        return response.status_code == 200
-    except requests.RequestException:
-        return False
+# Route all of pytube's requests through the pooled keep-alive transport
+install_transport()
+install_player_cache()
 
 def format_description(description):
     return description.replace('\n', '<br>\n')
 
-def upload_to_buzzsprout(title, description, file_url, env_path):
-    load_dotenv(env_path)
-    buzzsprout_api_key = os.getenv('BUZZSPROUT_API_KEY')
-    buzzsprout_podcast_id = os.getenv('BUZZSPROUT_PODCAST_ID')
-
-    logging.info(f"Using Buzzsprout API Key: {buzzsprout_api_key}")
-    logging.info(f"Using Buzzsprout Podcast ID: {buzzsprout_podcast_id}")
-
-    if not is_url_accessible(file_url):
-        logging.info(f"Failed to upload episode '{title}' to Buzzsprout: URL not accessible")
-        return False
-
-    url = f'https://www.buzzsprout.com/api/{buzzsprout_podcast_id}/episodes'
-    headers = {
-        'Authorization': f'Token token={buzzsprout_api_key}',
-        'Content-Type': 'application/json',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    data = {
-        'title': title,
-        'description': format_description(description),
-        'audio_url': file_url
+def upload_to_buzzsprout(buzzsprout, title, description, file_url):
+    return buzzsprout.create_episode(title, format_description(description), file_url)
+
+# YouTube Data API clients are reused across calls. Each one owns a keep-alive
+# httplib2 connection, which isn't safe to share, so a client is checked out
+# by one thread or greenlet at a time and returned to its API key's idle list.
+YOUTUBE_API_TIMEOUT = int(os.getenv('YOUTUBE_API_TIMEOUT', 30))
+youtube_discovery_document = None
+youtube_clients = {}
+youtube_clients_lock = threading.Lock()
+
+def get_youtube_discovery_document():
+    global youtube_discovery_document
+    if youtube_discovery_document is None:
+        # The discovery document bundled with google-api-python-client, parsed once per process
+        youtube_discovery_document = json.loads(get_static_doc('youtube', 'v3'))
+    return youtube_discovery_document
+
+@contextmanager
+def youtube_client(api_key):
+    with youtube_clients_lock:
+        idle = youtube_clients.setdefault(api_key, [])
+        youtube = idle.pop() if idle else None
+    if youtube is None:
+        youtube = build_from_document(
+            get_youtube_discovery_document(),
+            developerKey=api_key,
+            http=httplib2.Http(timeout=YOUTUBE_API_TIMEOUT)
+        )
+    try:
+        yield youtube
+    finally:
+        with youtube_clients_lock:
+            idle.append(youtube)
+
+def parse_video_details(item):
+    return {
+        "title": item['snippet']['title'],
+        "description": item['snippet']['description'],
+        "duration": int(isodate.parse_duration(item['contentDetails']['duration']).total_seconds()),
+        "live": item['snippet'].get('liveBroadcastContent', 'none'),
+        "published_at": item['snippet'].get('publishedAt'),
+        "availability": "available"
     }
-    response = requests.post(url, headers=headers, json=data)
-    if response.status_code == 201:
-        logging.info(f"Episode '{title}' uploaded successfully to Buzzsprout.")
-        return response.json().get('id')
-    else:
-        logging.info(f"Failed to upload episode '{title}' to Buzzsprout: {response.content}")
-        return None
-
-def get_channel_videos(channel_id, api_key):
-    youtube = build('youtube', 'v3', developerKey=api_key)
-    video_urls = []
-    next_page_token = None
 
-    while True:
-        request = youtube.search().list(
-            part="snippet",
-            channelId=channel_id,
-            maxResults=50,
-            order="date",
-            pageToken=next_page_token
+def enrich_videos(youtube, video_urls):
+    # Metadata comes from the local store first. The rest is fetched with one
+    # videos.list call per 50 IDs, videos missing from the response are private
+    # or deleted and are remembered as unavailable.
+    details = get_cached_videos([video["video_id"] for video in video_urls])
+    missing = [video["video_id"] for video in video_urls if video["video_id"] not in details]
+    for i in range(0, len(missing), 50):
+        ids = missing[i:i + 50]
+        request = youtube.videos().list(
+            part="snippet,contentDetails",
+            id=",".join(ids),
+            maxResults=50
         )
+        # Not revalidated by ETag: the same 50 IDs rarely come together again,
+        # and the metadata store already keeps what was fetched
         response = request.execute()
-        logging.info(f"API response for channel videos: {response}")
-
-        video_urls.extend([
-            {"url": "https://www.youtube.com/watch?v=" + item['id']['videoId'], "description": item['snippet']['description']}
-            for item in response['items'] if item['id']['kind'] == 'youtube#video'
-        ])
-
-        next_page_token = response.get('nextPageToken')
-        if not next_page_token:
-            break
-
-    logging.info(f"Fetched video URLs: {video_urls}")
-    return video_urls
-
-def get_playlist_videos(playlist_id, api_key):
-    youtube = build('youtube', 'v3', developerKey=api_key)
-    video_urls = []
-    next_page_token = None
-
-    while True:
+        fetched = {item['id']: parse_video_details(item) for item in response['items']}
+        for video_id in ids:
+            fetched.setdefault(video_id, {"availability": "unavailable"})
+        cache_videos(fetched)
+        details.update(fetched)
+
+    enriched = []
+    for video in video_urls:
+        if details[video["video_id"]]["availability"] != "available":
+            logging.info(f"Skipping video {video['url']} as it is unavailable.")
+            continue
+        enriched.append({**video, **details[video["video_id"]]})
+    return enriched
+
+def fetch_playlist_page(api_key, playlist_id, page_token, since=None):
+    with youtube_client(api_key) as youtube:
         request = youtube.playlistItems().list(
             part="snippet",
             playlistId=playlist_id,
             maxResults=50,
-            pageToken=next_page_token
+            pageToken=page_token
         )
-        response = request.execute()
-        logging.info(f"API response for playlist videos: {response}")
+        response = execute_conditional(request, f"playlistItems:{playlist_id}:{page_token or ''}")
 
-        video_urls.extend([
-            {"url": "https://www.youtube.com/watch?v=" + item['snippet']['resourceId']['videoId'], "description": item['snippet']['description']}
+        video_urls = [
+            {"video_id": item['snippet']['resourceId']['videoId'], "url": "https://www.youtube.com/watch?v=" + item['snippet']['resourceId']['videoId'], "description": item['snippet']['description'], "added_at": item['snippet'].get('publishedAt')}
             for item in response['items']
-        ])
-
-        next_page_token = response.get('nextPageToken')
-        if not next_page_token:
-            break
-
-    logging.info(f"Fetched video URLs: {video_urls}")
-    return video_urls
+        ]
+
+        # Items added at or before the sync mark were handled by an earlier job
+        reached_mark = False
+        if since:
+            newer = [video for video in video_urls if not video["added_at"] or isodate.parse_datetime(video["added_at"]) > since]
+            reached_mark = len(newer) < len(video_urls)
+            video_urls = newer
+        return enrich_videos(youtube, video_urls), response.get('nextPageToken'), reached_mark
+
+def fetch_playlist_videos(api_key, playlist_id, since=None, stop_at_mark=False):
+    # Yields one enriched batch per API page. The next page is fetched in the
+    # background while the caller works on the current one.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        page = executor.submit(fetch_playlist_page, api_key, playlist_id, None, since)
+        while page:
+            video_urls, next_page_token, reached_mark = page.result()
+            if reached_mark and stop_at_mark:
+                next_page_token = None
+            page = executor.submit(fetch_playlist_page, api_key, playlist_id, next_page_token, since) if next_page_token else None
+            logging.info(f"Fetched {len(video_urls)} videos from playlist {playlist_id}")
+            yield video_urls
+
+def get_channel_videos(channel_id, api_key, since=None):
+    # Paging the uploads playlist costs 1 quota unit per page instead of the
+    # 100 charged by search().list, and it doesn't drop videos on large channels
+    with youtube_client(api_key) as youtube:
+        response = youtube.channels().list(
+            part="contentDetails",
+            id=channel_id
+        ).execute()
+    if not response.get("items"):
+        raise ValueError(f"Channel {channel_id} not found.")
+    uploads_playlist_id = response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+    logging.info(f"Using uploads playlist {uploads_playlist_id} for channel {channel_id}")
+
+    # The uploads playlist is ordered newest first, so paging can stop at the sync mark
+    yield from fetch_playlist_videos(api_key, uploads_playlist_id, since, stop_at_mark=True)
+
+def get_playlist_videos(playlist_id, api_key, since=None):
+    # Other playlists can be in any order, older items are only filtered out
+    yield from fetch_playlist_videos(api_key, playlist_id, since)
 
 def emit_status(message):
     logging.info(f"Emitting status: {message}")
@@ -153,18 +185,17 @@ def emit_status(message):
     socketio.emit('status_update', {'status': message}, namespace='/')
 
 def resolve_channel_url(url, api_key):
-    youtube = build('youtube', 'v3', developerKey=api_key)
-
     try:
         if "youtube.com/@" in url:
             handle = url.split('@')[1].split('/')[0]
-            request = youtube.search().list(
-                part="snippet",
-                q=handle,
-                type="channel",
-                maxResults=1
-            )
-            response = request.execute()
+            with youtube_client(api_key) as youtube:
+                request = youtube.search().list(
+                    part="snippet",
+                    q=handle,
+                    type="channel",
+                    maxResults=1
+                )
+                response = request.execute()
             if "items" in response and response["items"]:
                 return "https://www.youtube.com/channel/" + response["items"][0]["snippet"]["channelId"]
             else:
@@ -184,11 +215,12 @@ def resolve_channel_url(url, api_key):
 
         elif "youtube.com/user/" in url:
             user = url.split('user/')[1].split('/')[0]
-            request = youtube.channels().list(
-                part="id",
-                forUsername=user
-            )
-            response = request.execute()
+            with youtube_client(api_key) as youtube:
+                request = youtube.channels().list(
+                    part="id",
+                    forUsername=user
+                )
+                response = request.execute()
             if "items" in response and response["items"]:
                 return "https://www.youtube.com/channel/" + response["items"][0]["id"]
             else:
@@ -199,10 +231,389 @@ def resolve_channel_url(url, api_key):
 
     return None
 
-@celery_app.task(bind=True)
-def download_channel_podcast(self, url, min_duration=None, max_duration=None, title_filter=None, env_path=None):
+# Number of videos handed to each fan-out subtask
+VIDEO_CHUNK_SIZE = int(os.getenv('VIDEO_CHUNK_SIZE', 5))
+
+# Per-stage worker counts for the in-process video pipeline
+PIPELINE_METADATA_WORKERS = int(os.getenv('PIPELINE_METADATA_WORKERS', 2))
+PIPELINE_DOWNLOAD_WORKERS = int(os.getenv('PIPELINE_DOWNLOAD_WORKERS', 2))
+PIPELINE_UPLOAD_WORKERS = int(os.getenv('PIPELINE_UPLOAD_WORKERS', 2))
+PIPELINE_PUBLISH_WORKERS = int(os.getenv('PIPELINE_PUBLISH_WORKERS', 1))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 2))
+
+# How long a worker's claim on a video holds before another job may take it over
+VIDEO_CLAIM_TTL = int(os.getenv('VIDEO_CLAIM_TTL', 6 * 60 * 60))
+
+def filter_videos(video_urls, min_duration, max_duration, title_filter):
+    # Filters run on the videos.list data so skipped videos never reach pytube
+    selected = []
+    for video in video_urls:
+        if video["live"] != "none":
+            logging.info(f"Skipping video '{video['title']}' as it is a {video['live']} live broadcast.")
+            continue
+
+        if min_duration is not None and video["duration"] < min_duration:
+            logging.info(f"Skipping video '{video['title']}' as it does not meet the minimum duration filter.")
+            continue
+
+        if max_duration is not None and video["duration"] > max_duration:
+            logging.info(f"Skipping video '{video['title']}' as it does not meet the maximum duration filter.")
+            continue
+
+        if title_filter and title_filter.lower() not in video["title"].lower():
+            logging.info(f"Skipping video '{video['title']}' as it does not meet the title filter.")
+            continue
+
+        selected.append(video)
+    return selected
+
+def drop_published_videos(video_urls, podcast_id):
+    entries = get_ledger_entries(podcast_id, [video["video_id"] for video in video_urls])
+    unpublished = []
+    for video in video_urls:
+        if entries.get(video["video_id"], {}).get("state") == "published":
+            logging.info(f"Skipping video '{video['title']}' as it is already published as episode {entries[video['video_id']]['episode_id']}.")
+            continue
+        unpublished.append(video)
+    return unpublished
+
+def fetch_video_metadata(job):
+    video = job["video"]
+    if is_run_stopped(job["job_id"], job["run_id"]):
+        logging.info(f"Skipping video '{video['title']}' as its job was stopped.")
+        job["failed"].append(video.get("added_at"))
+        return None
+
+    # Checked again here in case another job published the video since dispatch
+    entry = get_ledger_entry(job["podcast_id"], video["video_id"])
+    if entry.get("state") == "published":
+        logging.info(f"Skipping video '{video['title']}' as it is already published as episode {entry['episode_id']}.")
+        return None
+
+    # Claims belong to this run of the job, so a redelivered chunk takes its
+    # own claims back. A video held by another job, or by an earlier run of
+    # this one, is left for the next sync like any other failure.
+    if not claim_video(job["podcast_id"], video["video_id"], job["owner"], VIDEO_CLAIM_TTL):
+        logging.info(f"Skipping video '{video['title']}' as another job is processing it.")
+        job["failed"].append(video.get("added_at"))
+        return None
+
+    if entry.get("state") == "uploaded":
+        # Audio is already in S3 from an earlier run, only the publish is left.
+        # The URL is signed again as the stored one may have expired.
+        job["s3_url"] = audio_url(os.getenv('AWS_BUCKET_NAME'), entry["s3_key"])
+        return job
+
+    # Another job, possibly for a different podcast, may already have stored this video
+    s3_key = get_indexed_object(os.getenv('AWS_BUCKET_NAME'), object_name(video["video_id"], job["profile"]))
+    if s3_key:
+        logging.info(f"Reusing stored audio {s3_key} for video '{video['title']}'.")
+        job["s3_url"] = audio_url(os.getenv('AWS_BUCKET_NAME'), s3_key)
+        record_ledger_entry(job["podcast_id"], video["video_id"], "uploaded", s3_key=s3_key, s3_url=job["s3_url"])
+        return job
+
+    job["yt"] = YouTube(video["url"])
+    return job
+
+def download_video_audio(job):
+    if "s3_url" in job:
+        return job
+    video = job["video"]
+    audio_stream = select_audio_stream(job["yt"].streams, job["profile"])
+    job["plan"] = conversion_plan(audio_stream, job["profile"])
+    # A resumed job finds its finished download in the shared cache
+    job["cache_entry"], job["file_path"] = acquire_cached_audio(video["video_id"], audio_stream, job["owner"])
+    return job
+
+def transcode_video_audio(job):
+    if "s3_url" in job:
+        return job
+    video = job["video"]
+    output_path = os.path.join(job["download_path"], f'{video["video_id"]}.{AUDIO_FORMATS[job["plan"]["format"]]["extension"]}')
+    artwork_path = fetch_artwork(job)
+    try:
+        transcode_file(job["file_path"], output_path, job["plan"], episode_tags(job), artwork_path)
+    except Exception:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    finally:
+        if artwork_path:
+            os.remove(artwork_path)
+    record_savings(job, os.path.getsize(job["file_path"]), os.path.getsize(output_path))
+    # The source stays in the shared cache, only the episode file is this job's
+    release_cached_audio(job.pop("cache_entry"), job["owner"])
+    job["file_path"] = output_path
+    return job
+
+def record_savings(job, source_bytes, output_bytes):
+    logging.info(f"Encoded '{job['video']['title']}' with profile {job['profile']}: {output_bytes} bytes from a {source_bytes} byte source")
+    job["savings"].append((source_bytes, output_bytes))
+
+def episode_tags(job):
+    return {
+        'title': job["video"]["title"],
+        'artist': job["yt"].author,
+        'date': (job["video"].get("published_at") or "")[:10],
+        'comment': job["video"].get("description"),
+    }
+
+def fetch_artwork(job):
+    # The video thumbnail becomes the episode's cover art, without one the
+    # episode is simply encoded without artwork
+    url = job["yt"].thumbnail_url
+    extension = os.path.splitext(urllib.parse.urlparse(url).path)[1] or '.jpg'
+    artwork_path = os.path.join(job["download_path"], f'{job["video"]["video_id"]}{extension}')
+    try:
+        response = get_session().get(url, timeout=30)
+        response.raise_for_status()
+        with open(artwork_path, 'wb') as f:
+            f.write(response.content)
+    except Exception as e:
+        logging.info(f"No artwork for video '{job['video']['title']}': {e}")
+        return None
+    return artwork_path
+
+def upload_progress(video):
+    return lambda percent: emit_status(f"Uploading '{video['title']}': {percent}%")
+
+def counted(chunks, progress):
+    for chunk in chunks:
+        progress(len(chunk))
+        yield chunk
+
+def upload_video_audio(job):
+    if "s3_url" in job:
+        return job
+    audio_format = AUDIO_FORMATS[job["plan"]["format"]]
+    s3_key = content_key(job["video"]["video_id"], file_digest(job["file_path"]), audio_format["extension"], job["profile"])
+    try:
+        job["s3_url"] = upload_to_s3(job["file_path"], os.getenv('AWS_BUCKET_NAME'), s3_key, upload_progress(job["video"]), audio_format["content_type"])
+    finally:
+        # A retry encodes again from the cached source, so the episode file never outlives its upload
+        os.remove(job["file_path"])
+    add_indexed_object(os.getenv('AWS_BUCKET_NAME'), object_name(job["video"]["video_id"], job["profile"]), s3_key)
+    record_ledger_entry(job["podcast_id"], job["video"]["video_id"], "uploaded", s3_key=s3_key, s3_url=job["s3_url"])
+    return job
+
+def stream_video_audio(job):
+    if "s3_url" in job:
+        return job
+    video = job["video"]
+    audio_stream = select_audio_stream(job["yt"].streams, job["profile"])
+    plan = conversion_plan(audio_stream, job["profile"])
+    audio_format = AUDIO_FORMATS[plan["format"]]
+    # The key has to be known before the first byte arrives, so streamed audio
+    # is addressed by what identifies its bytes upstream: video, itag, size and
+    # how it is converted
+    identity = hashlib.sha256(f'{video["video_id"]}:{audio_stream.itag}:{audio_stream.filesize}:{plan["format"]}:{plan_encoding(plan)}'.encode('utf-8')).hexdigest()
+    s3_key = content_key(video["video_id"], identity, audio_format["extension"], job["profile"])
+    # The encoded size isn't known up front, so progress follows the source bytes
+    source_progress = TransferProgress(audio_stream.filesize, upload_progress(video))
+    output_progress = TransferProgress(None)
+    source = counted(request.stream(audio_stream.url), source_progress)
+    artwork_path = fetch_artwork(job)
+    try:
+        output = counted(transcode_stream(source, plan, episode_tags(job), artwork_path), output_progress)
+        job["s3_url"] = stream_to_s3(output, os.getenv('AWS_BUCKET_NAME'), s3_key, content_type=audio_format["content_type"])
+    finally:
+        if artwork_path:
+            os.remove(artwork_path)
+    record_savings(job, source_progress.sent, output_progress.sent)
+    add_indexed_object(os.getenv('AWS_BUCKET_NAME'), object_name(video["video_id"], job["profile"]), s3_key)
+    record_ledger_entry(job["podcast_id"], video["video_id"], "uploaded", s3_key=s3_key, s3_url=job["s3_url"])
+    return job
+
+def publish_video_episode(job):
+    video = job["video"]
+    buzzsprout_id = upload_to_buzzsprout(job["buzzsprout"], video["title"], video["description"], job["s3_url"])
+    if not buzzsprout_id:
+        # Rejected episodes count as failures so the sync mark stays before them
+        job["failed"].append(video.get("added_at"))
+        release_video(job["podcast_id"], video["video_id"], job["owner"])
+        return None
+    record_ledger_entry(job["podcast_id"], video["video_id"], "published", episode_id=buzzsprout_id)
+    release_video(job["podcast_id"], video["video_id"], job["owner"])
+    logging.info(f"Video titled: '{video['title']}' uploaded with ID {buzzsprout_id}")
+    emit_status(f"Video titled: '{video['title']}' uploaded with ID {buzzsprout_id}")
+    return {'title': video["title"], 'episode_id': buzzsprout_id}
+
+def log_video_failure(job, error):
+    logging.info(f"Failed to download video {job['video']['url']} due to error: {error}")
+    job["failed"].append(job["video"].get("added_at"))
+    if "cache_entry" in job:
+        release_cached_audio(job["cache_entry"], job["owner"])
+    release_video(job["podcast_id"], job["video"]["video_id"], job["owner"])
+
+# In streaming mode audio goes from YouTube through ffmpeg into S3 without touching local disk
+if STREAM_UPLOADS:
+    transfer_stages = [
+        Stage('stream', stream_video_audio, PIPELINE_DOWNLOAD_WORKERS),
+    ]
+else:
+    transfer_stages = [
+        Stage('download', download_video_audio, PIPELINE_DOWNLOAD_WORKERS),
+        Stage('transcode', transcode_video_audio, TRANSCODE_WORKERS),
+        Stage('upload', upload_video_audio, PIPELINE_UPLOAD_WORKERS),
+    ]
+
+# Downloads of the next video overlap with the upload and publish of the previous ones
+video_pipeline = Pipeline([
+    Stage('metadata', fetch_video_metadata, PIPELINE_METADATA_WORKERS),
+    *transfer_stages,
+    Stage('publish', publish_video_episode, PIPELINE_PUBLISH_WORKERS),
+], queue_size=PIPELINE_QUEUE_SIZE, on_error=log_video_failure)
+
+# acks_late with reject_on_worker_lost puts a chunk back on the queue if its
+# worker dies, every video then continues from the ledger and download cache
+@celery_app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_video_chunk(self, video_refs, context, newest=None, deferred=None, incomplete=False):
+    load_dotenv(context["env_path"])
+    os.makedirs(context["download_path"], exist_ok=True)
+    # Credentials are read from this job's own .env, load_dotenv won't
+    # override values an earlier job left in the worker's environment
+    credentials = dotenv_values(context["env_path"]) if context["env_path"] else os.environ
+    buzzsprout = get_buzzsprout_client(credentials.get('BUZZSPROUT_API_KEY'), credentials.get('BUZZSPROUT_PODCAST_ID'))
+    # Videos held back at dispatch count as failures, the mark must not pass them
+    failed = list(deferred or [])
+    savings = []
+    videos = []
+    if is_run_stopped(context["job_id"], context["run_id"]):
+        logging.info(f"Skipping {len(video_refs)} videos as job {context['job_id']} was stopped")
+        failed.extend(ref.get("added_at") for ref in video_refs)
+    elif video_refs:
+        # Chunks carry only video IDs and playlist times, the metadata comes
+        # from the store and anything that expired since dispatch is fetched again
+        videos = [{**ref, "url": "https://www.youtube.com/watch?v=" + ref["video_id"]} for ref in video_refs]
+        try:
+            with youtube_client(credentials.get('API_KEY')) as youtube:
+                videos = enrich_videos(youtube, videos)
+        except Exception as e:
+            logging.info(f"Failed to load metadata for {len(video_refs)} videos: {e}")
+            failed.extend(ref.get("added_at") for ref in video_refs)
+            videos = []
+
+    jobs = (
+        {
+            **context,
+            "video": video,
+            "owner": f"{context['job_id']}:{context['run_id']}",
+            "buzzsprout": buzzsprout,
+            "failed": failed,
+            "savings": savings
+        }
+        for video in videos
+    )
+    episodes = video_pipeline.run(jobs)
+    return {
+        "episodes": episodes,
+        "failed": failed,
+        "newest": newest,
+        "incomplete": incomplete,
+        "source_bytes": sum(source_bytes for source_bytes, _ in savings),
+        "output_bytes": sum(output_bytes for _, output_bytes in savings)
+    }
+
+def advance_sync_mark(results, source_id, podcast_id):
+    # Pages never dispatched leave nothing to hold the mark back, and paging
+    # stops at the mark, so a job stopped mid-dispatch leaves it where it is
+    if any(chunk.get("incomplete") for chunk in results):
+        logging.info(f"Sync mark for {source_id} on podcast {podcast_id} kept, not every page was dispatched")
+        return
+    newest = [chunk["newest"] for chunk in results if chunk["newest"]]
+    if not newest:
+        return
+    mark = max(newest, key=isodate.parse_datetime)
+
+    # A failed video has to be picked up again by the next job, so the mark
+    # stops just short of the oldest failure
+    failed = [added_at for chunk in results for added_at in chunk["failed"] if added_at]
+    if failed:
+        oldest_failure = isodate.parse_datetime(min(failed, key=isodate.parse_datetime))
+        mark = (oldest_failure - timedelta(seconds=1)).isoformat()
+
+    set_sync_mark(source_id, podcast_id, mark)
+    logging.info(f"Sync mark for {source_id} on podcast {podcast_id} is now {mark}")
+
+@celery_app.task
+def collect_uploaded_episodes(results, source_id=None, podcast_id=None, job_id=None, run_id=None):
+    uploaded_episodes = [episode for chunk in results for episode in chunk["episodes"]]
+    if source_id:
+        advance_sync_mark(results, source_id, podcast_id)
+    if job_id:
+        if is_job_cancelled(job_id):
+            emit_status("Conversion stopped, videos not yet converted will be picked up by the next sync.")
+        finish_job(job_id, run_id)
+
+    if len(uploaded_episodes) == 1:
+        emit_status(f"Upload complete, {len(uploaded_episodes)} episode has been uploaded to your Buzzsprout dashboard.")
+    else:
+        emit_status(f"Upload complete, {len(uploaded_episodes)} episodes have been uploaded to your Buzzsprout dashboard.")
+
+    source_bytes = sum(chunk.get("source_bytes", 0) for chunk in results)
+    output_bytes = sum(chunk.get("output_bytes", 0) for chunk in results)
+    if source_bytes:
+        # Encoding can also grow the audio, e.g. a low bitrate source encoded at a higher one
+        change = output_bytes - source_bytes
+        logging.info(f"Encoding for podcast {podcast_id} turned {source_bytes} source bytes into {output_bytes}")
+        if change < 0:
+            emit_status(f"Encoding saved {-change / 1024 / 1024:.1f} MB ({-change * 100 // source_bytes}%) against the source audio.")
+        else:
+            emit_status(f"Encoded audio is {change / 1024 / 1024:.1f} MB ({change * 100 // source_bytes}%) larger than the source audio.")
+    return uploaded_episodes
+
+def index_bucket(bucket_name):
+    objects = dict(list_audio_objects(bucket_name))
+    replace_object_index(bucket_name, objects)
+    logging.info(f"Indexed {len(objects)} stored episodes in bucket {bucket_name}")
+
+def dispatch_videos(video_batches, context, min_duration, max_duration, title_filter, source_id=None):
+    min_duration = int(min_duration) if min_duration else None
+    max_duration = int(max_duration) if max_duration else None
+    dispatched = [0]
+
+    def chunk_signatures():
+        for video_urls in video_batches:
+            # A stopped job fetches no further pages, and says so to the chord
+            # body so the sync mark stays put
+            if is_run_stopped(context["job_id"], context["run_id"]):
+                logging.info(f"Job {context['job_id']} was stopped, dispatching no further pages")
+                yield process_video_chunk.s([], context, incomplete=True)
+                return
+            # Each page's newest item travels with its chunks so the chord body
+            # can move the sync mark, pages with nothing left after filtering
+            # still send an empty chunk to carry it.
+            # Live and upcoming broadcasts are skipped for now but have to be
+            # picked up once they become VODs, so they travel as deferred
+            # failures that hold the mark back.
+            added = [video["added_at"] for video in video_urls if video.get("added_at")]
+            newest = max(added, key=isodate.parse_datetime) if added else None
+            deferred = [video["added_at"] for video in video_urls if video.get("added_at") and video["live"] != "none"]
+            video_urls = filter_videos(video_urls, min_duration, max_duration, title_filter)
+            video_urls = drop_published_videos(video_urls, context["podcast_id"])
+            dispatched[0] += len(video_urls)
+            if not video_urls and (newest or deferred):
+                yield process_video_chunk.s([], context, newest, deferred)
+            # Celery keeps every signature of a generator header until dispatch
+            # ends, so they hold only what the chunk can't read from the store
+            refs = [{"video_id": video["video_id"], "added_at": video.get("added_at")} for video in video_urls]
+            for i in range(0, len(refs), VIDEO_CHUNK_SIZE):
+                yield process_video_chunk.s(refs[i:i + VIDEO_CHUNK_SIZE], context, newest, deferred if i == 0 else [])
+
+    # One subtask per chunk so a large backfill spreads across every worker,
+    # the chord body then reports the combined result once all chunks finish.
+    # The header is a generator, so chunks are sent as each API page arrives.
+    result = chord(group(chunk_signatures()))(collect_uploaded_episodes.s(source_id, context["podcast_id"], context["job_id"], context["run_id"]))
+    logging.info(f"Dispatched {dispatched[0]} videos in chunks of {VIDEO_CHUNK_SIZE}, collecting in task {result.id}")
+    return result.id
+
+@celery_app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def download_channel_podcast(self, url, min_duration=None, max_duration=None, title_filter=None, env_path=None, encoding_profile='default'):
     logging.info(f"Loading .env file from: {env_path}")
     load_dotenv(env_path)
+    save_job(self.request.id, 'channel', [url, min_duration, max_duration, title_filter, env_path, encoding_profile])
+    run_id = uuid.uuid4().hex
+    start_job(self.request.id, run_id)
     try:
         api_key = os.getenv('API_KEY')
         if not api_key:
@@ -218,56 +629,30 @@ def download_channel_podcast(self, url, min_duration=None, max_duration=None, ti
         download_path = os.path.join("downloaded", channel_id)
         os.makedirs(download_path, exist_ok=True)
 
-        video_urls = get_channel_videos(channel_id, api_key)
+        podcast_id = dotenv_values(env_path).get('BUZZSPROUT_PODCAST_ID') if env_path else None
+        since = get_sync_mark(channel_id, podcast_id)
+        if since:
+            logging.info(f"Syncing channel {channel_id} from videos published after {since}")
+        video_batches = get_channel_videos(channel_id, api_key, isodate.parse_datetime(since) if since else None)
+        index_bucket(os.getenv('AWS_BUCKET_NAME'))
         logging.info("Processing started...")
-        uploaded_episodes = []
-
-        for video in video_urls:
-            try:
-                yt = YouTube(video["url"])
-                video_duration = yt.length
-                min_duration = int(min_duration) if min_duration else None
-                max_duration = int(max_duration) if max_duration else None
-
-                if min_duration is not None and video_duration < min_duration:
-                    logging.info(f"Skipping video '{yt.title}' as it does not meet the minimum duration filter.")
-                    continue
-
-                if max_duration is not None and video_duration > max_duration:
-                    logging.info(f"Skipping video '{yt.title}' as it does not meet the maximum duration filter.")
-                    continue
-
-                if title_filter and title_filter.lower() not in yt.title.lower():
-                    logging.info(f"Skipping video '{yt.title}' as it does not meet the title filter.")
-                    continue
-
-                yt.streams.filter(only_audio=True).first().download(output_path=download_path, filename=f'{sanitize_filename(yt.title)}.mp3')
-                file_path = os.path.join(download_path, f'{sanitize_filename(yt.title)}.mp3')
-
-                s3_url = upload_to_s3(file_path, os.getenv('AWS_BUCKET_NAME'), f'podcasts/{sanitize_filename(yt.title)}.mp3')
-                buzzsprout_id = upload_to_buzzsprout(yt.title, yt.description, s3_url, env_path)
-                if buzzsprout_id:
-                    logging.info(f"Video {yt.title} uploaded with ID {buzzsprout_id}")
-                    emit_status(f"Video {yt.title} uploaded with ID {buzzsprout_id}")
-                    uploaded_episodes.append({'title': yt.title, 'episode_id': buzzsprout_id})
-                os.remove(file_path)
-            except Exception as e:
-                logging.info(f"Failed to download video {video['url']} due to error: {e}")
-
-        if len(uploaded_episodes) == 1:
-            emit_status(f"Upload complete, {len(uploaded_episodes)} episode has been uploaded to your Buzzsprout dashboard.")
-        else:
-            emit_status(f"Upload complete, {len(uploaded_episodes)} episodes have been uploaded to your Buzzsprout dashboard.")
-        return uploaded_episodes
+        # The profile travels with the job, so each job's chunks encode the
+        # way it was started even if the podcast's settings change meanwhile
+        context = {"download_path": download_path, "env_path": env_path, "podcast_id": podcast_id, "job_id": self.request.id, "run_id": run_id, "profile": encoding_profile}
+        return dispatch_videos(video_batches, context, min_duration, max_duration, title_filter, channel_id)
     except Exception as e:
         logging.info(f"Error processing channel: {e}")
         emit_status(f"Error processing channel: {e}")
+        finish_job(self.request.id, run_id)
         return []
 
-@celery_app.task(bind=True)
-def download_playlist_podcast(self, url, min_duration=None, max_duration=None, title_filter=None, env_path=None):
+@celery_app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def download_playlist_podcast(self, url, min_duration=None, max_duration=None, title_filter=None, env_path=None, encoding_profile='default'):
     logging.info(f"Loading .env file from: {env_path}")
     load_dotenv(env_path)
+    save_job(self.request.id, 'playlist', [url, min_duration, max_duration, title_filter, env_path, encoding_profile])
+    run_id = uuid.uuid4().hex
+    start_job(self.request.id, run_id)
     try:
         api_key = os.getenv('API_KEY')
         if not api_key:
@@ -283,51 +668,34 @@ def download_playlist_podcast(self, url, min_duration=None, max_duration=None, t
         download_path = os.path.join("downloaded", playlist_id)
         os.makedirs(download_path, exist_ok=True)
 
-        video_urls = get_playlist_videos(playlist_id, api_key)
+        podcast_id = dotenv_values(env_path).get('BUZZSPROUT_PODCAST_ID') if env_path else None
+        since = get_sync_mark(playlist_id, podcast_id)
+        if since:
+            logging.info(f"Syncing playlist {playlist_id} from videos added after {since}")
+        video_batches = get_playlist_videos(playlist_id, api_key, isodate.parse_datetime(since) if since else None)
+        index_bucket(os.getenv('AWS_BUCKET_NAME'))
         logging.info("Processing started...")
-        uploaded_episodes = []
-
-        for video in video_urls:
-            try:
-                yt = YouTube(video["url"])
-                video_duration = yt.length
-                min_duration = int(min_duration) if min_duration else None
-                max_duration = int(max_duration) if max_duration else None
-
-                if min_duration is not None and video_duration < min_duration:
-                    logging.info(f"Skipping video '{yt.title}' as it does not meet the minimum duration filter.")
-                    continue
-
-                if max_duration is not None and video_duration > max_duration:
-                    logging.info(f"Skipping video '{yt.title}' as it does not meet the maximum duration filter.")
-                    continue
-
-                if title_filter and title_filter.lower() not in yt.title.lower():
-                    logging.info(f"Skipping video '{yt.title}' as it does not meet the title filter.")
-                    continue
-
-                yt.streams.filter(only_audio=True).first().download(output_path=download_path, filename=f'{sanitize_filename(yt.title)}.mp3')
-                file_path = os.path.join(download_path, f'{sanitize_filename(yt.title)}.mp3')
-
-                s3_url = upload_to_s3(file_path, os.getenv('AWS_BUCKET_NAME'), f'podcasts/{sanitize_filename(yt.title)}.mp3')
-                buzzsprout_id = upload_to_buzzsprout(yt.title, yt.description, s3_url, env_path)
-                if buzzsprout_id:
-                    logging.info(f"Video titled: '{yt.title}' uploaded with ID {buzzsprout_id}")
-                    emit_status(f"Video titled: '{yt.title}' uploaded with ID {buzzsprout_id}")
-                    uploaded_episodes.append({'title': yt.title, 'episode_id': buzzsprout_id})
-                os.remove(file_path)
-            except Exception as e:
-                logging.info(f"Failed to download video {video['url']} due to error: {e}")
-
-        if len(uploaded_episodes) == 1:
-            emit_status(f"Upload complete, {len(uploaded_episodes)} episode has been uploaded to your Buzzsprout dashboard.")
-        else:
-            emit_status(f"Upload complete, {len(uploaded_episodes)} episodes have been uploaded to your Buzzsprout dashboard.")
-        return uploaded_episodes
+        # The profile travels with the job, so each job's chunks encode the
+        # way it was started even if the podcast's settings change meanwhile
+        context = {"download_path": download_path, "env_path": env_path, "podcast_id": podcast_id, "job_id": self.request.id, "run_id": run_id, "profile": encoding_profile}
+        return dispatch_videos(video_batches, context, min_duration, max_duration, title_filter, playlist_id)
     except Exception as e:
         logging.info(f"Error processing playlist: {e}")
         emit_status(f"Error processing playlist: {e}")
+        finish_job(self.request.id, run_id)
         return []
 
-def sanitize_filename(filename):
-    return "".join([c if c.isalnum() else "_" for c in filename])
+def resume_job(job_id):
+    # Runs the job again under its own ID, the publish ledger, the S3 object
+    # index and the download cache (including partial downloads) carry it on
+    # from where it stopped. A job whose chunks may still be running can't be
+    # resumed, both runs would publish the same videos.
+    job = load_job(job_id)
+    if not job:
+        return None
+    if is_job_active(job_id):
+        raise ValueError(f"Job {job_id} is still running, stop it and wait for it to finish before resuming")
+    clear_job_cancel(job_id)
+    task = download_channel_podcast if job["kind"] == "channel" else download_playlist_podcast
+    logging.info(f"Resuming {job['kind']} job {job_id}")
+    return task.apply_async(args=job["args"], task_id=job_id)
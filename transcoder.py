@@ -0,0 +1,496 @@
+import os
+import re
+import math
+import time
+import fcntl
+import tempfile
+import json
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import ffmpeg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Episode audio format and bitrate. "auto" keeps AAC sources as they are and
+# only remuxes them into .m4a, everything else (opus/webm) is encoded to MP3.
+# "mp3" always encodes to MP3, "aac" encodes non-AAC sources to AAC.
+# Every encode is a single-threaded ffmpeg process. The host's cores are
+# shared by the CELERY_WORKER_CONCURRENCY worker processes (celery's own
+# default is one per core, set it to the worker's --concurrency), so each
+# process runs its share of them as whole files, never fewer than one.
+# TRANSCODE_HOST_SLOTS is the host's budget across all processes: every
+# ffmpeg pass holds one of them, and the segments of a long episode take as
+# many as are free, so they borrow the cores other processes leave idle.
+TRANSCODE_FORMAT = os.getenv('TRANSCODE_FORMAT', 'auto')
+TRANSCODE_BITRATE = os.getenv('TRANSCODE_BITRATE', '128k')
+CELERY_WORKER_CONCURRENCY = int(os.getenv('CELERY_WORKER_CONCURRENCY', os.cpu_count() or 1))
+TRANSCODE_WORKERS = int(os.getenv('TRANSCODE_WORKERS', max(1, (os.cpu_count() or 1) // max(1, CELERY_WORKER_CONCURRENCY))))
+TRANSCODE_HOST_SLOTS = int(os.getenv('TRANSCODE_HOST_SLOTS', os.cpu_count() or 1))
+TRANSCODE_SLOTS_DIR = os.getenv('TRANSCODE_SLOTS_DIR', os.path.join(tempfile.gettempdir(), 'transcode-slots'))
+READ_SIZE = 64 * 1024
+
+# Source stream selection: the audio bitrate to aim for in kbps (spoken word
+# sounds the same at 48-70 kbps as at 160), a codec to prefer ("opus" or
+# "mp4a"), the largest source to accept in bytes (0 for no limit) and how many
+# kbps further from the target an AAC source that only needs a remux may be and
+# still win over the closest stream (0 to never prefer it)
+STREAM_TARGET_BITRATE = int(os.getenv('STREAM_TARGET_BITRATE', 64))
+STREAM_PREFERRED_CODEC = os.getenv('STREAM_PREFERRED_CODEC', '')
+STREAM_MAX_FILESIZE = int(os.getenv('STREAM_MAX_FILESIZE', 0))
+STREAM_REMUX_TOLERANCE = float(os.getenv('STREAM_REMUX_TOLERANCE', 16))
+
+# Episodes longer than TRANSCODE_SEGMENT_THRESHOLD seconds are cut into
+# segments of about TRANSCODE_SEGMENT_SECONDS that are encoded in parallel.
+# Cuts fall on codec frame boundaries and each segment is encoded with
+# SEGMENT_OVERLAP seconds of audio either side of its cuts, so the encoder's
+# priming and padding land in frames that are dropped at the join. Each cut
+# is also moved to the nearest silence within TRANSCODE_SILENCE_WINDOW seconds
+# where there is one.
+TRANSCODE_SEGMENT_THRESHOLD = float(os.getenv('TRANSCODE_SEGMENT_THRESHOLD', 60 * 60))
+TRANSCODE_SEGMENT_SECONDS = float(os.getenv('TRANSCODE_SEGMENT_SECONDS', 10 * 60))
+TRANSCODE_SILENCE_WINDOW = float(os.getenv('TRANSCODE_SILENCE_WINDOW', 30))
+SEGMENT_OVERLAP = 1.0
+
+# Whole files and streams hold one of this process's slots while ffmpeg runs,
+# so they stay within its share of the cores. Files and segments queue on the
+# pool, which is big enough for one episode's segments to fill the host.
+encode_slots = threading.BoundedSemaphore(TRANSCODE_WORKERS)
+encode_pool = ThreadPoolExecutor(max_workers=max(TRANSCODE_WORKERS, TRANSCODE_HOST_SLOTS))
+
+AUDIO_FORMATS = {
+    'mp3': {'extension': 'mp3', 'format': 'mp3', 'acodec': 'libmp3lame', 'content_type': 'audio/mpeg'},
+    'aac': {'extension': 'm4a', 'format': 'ipod', 'acodec': 'aac', 'content_type': 'audio/mp4'},
+}
+# Encoding profiles a podcast can choose. "default" follows TRANSCODE_FORMAT
+# and TRANSCODE_BITRATE and may remux, the spoken-word profiles always encode
+# to a mono, resampled file at a fixed (CBR) bitrate or a VBR quality level.
+# More can be added as JSON in ENCODING_PROFILES, they are shown by name.
+PROFILE_SETTINGS = ('format', 'bitrate', 'quality', 'channels', 'sample_rate')
+PROFILE_LABELS = {
+    'default': 'Default',
+    'spoken-64': 'Spoken word, mono 64 kbps',
+    'spoken-48': 'Spoken word, mono 48 kbps',
+    'spoken-vbr': 'Spoken word, mono VBR',
+    'spoken-aac': 'Spoken word, mono AAC 48 kbps',
+}
+
+def load_encoding_profiles(profiles, custom):
+    # Custom profiles are checked here, so a bad one stops the app and the
+    # workers from starting instead of failing every job that picks it
+    for name, settings in custom.items():
+        if name == 'default':
+            raise ValueError("ENCODING_PROFILES can't redefine the default profile")
+        if not isinstance(settings, dict) or settings.get('format') not in AUDIO_FORMATS:
+            raise ValueError(f"Encoding profile '{name}' needs a format, one of: {', '.join(AUDIO_FORMATS)}")
+        unknown = set(settings) - set(PROFILE_SETTINGS)
+        if unknown:
+            raise ValueError(f"Encoding profile '{name}' has unknown settings: {', '.join(sorted(unknown))}")
+    return {**profiles, **custom}
+
+ENCODING_PROFILES = load_encoding_profiles({
+    'default': {},
+    'spoken-64': {'format': 'mp3', 'bitrate': '64k', 'channels': 1, 'sample_rate': 44100},
+    'spoken-48': {'format': 'mp3', 'bitrate': '48k', 'channels': 1, 'sample_rate': 22050},
+    'spoken-vbr': {'format': 'mp3', 'quality': 7, 'channels': 1, 'sample_rate': 44100},
+    'spoken-aac': {'format': 'aac', 'bitrate': '48k', 'channels': 1, 'sample_rate': 44100},
+}, json.loads(os.getenv('ENCODING_PROFILES', '{}')))
+
+# Loudness normalization in the encoding graph: single-pass loudnorm to the
+# usual podcast target of -16 LUFS. Segmented episodes are measured once as a
+# whole and every segment gets the same linear gain, so levels match across
+# the joins. Remuxed audio is copied and left as is.
+AUDIO_LOUDNORM = os.getenv('AUDIO_LOUDNORM', 'true').lower() in ('1', 'true', 'yes')
+LOUDNORM_TARGET = float(os.getenv('LOUDNORM_TARGET', -16))
+LOUDNORM_TRUE_PEAK = float(os.getenv('LOUDNORM_TRUE_PEAK', -1.5))
+LOUDNORM_RANGE = float(os.getenv('LOUDNORM_RANGE', 11))
+
+# Raw elementary streams for segments, they are joined frame by frame. MP3
+# segments go without the bit reservoir, the first frame kept after a cut
+# would otherwise point back into bytes of a dropped frame.
+SEGMENT_FORMATS = {'mp3': 'mp3', 'aac': 'adts'}
+SEGMENT_ARGS = {
+    'mp3': {'reservoir': 0, 'write_xing': 0, 'id3v2_version': 0},
+    'aac': {},
+}
+
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def is_aac(stream):
+    audio_codec = stream.parse_codecs()[1] or ''
+    return audio_codec.startswith('mp4a')
+
+def can_remux(stream, profile):
+    return profile == 'default' and TRANSCODE_FORMAT != 'mp3' and is_aac(stream)
+
+def bitrate_distance(stream):
+    return abs(stream.bitrate / 1000 - STREAM_TARGET_BITRATE) if stream.bitrate else float('inf')
+
+def stream_rank(stream):
+    audio_codec = stream.parse_codecs()[1] or ''
+    codec = not STREAM_PREFERRED_CODEC or audio_codec.startswith(STREAM_PREFERRED_CODEC)
+    return (not codec, bitrate_distance(stream), stream.filesize_approx)
+
+def select_audio_stream(streams, profile='default'):
+    audio_streams = list(streams.filter(only_audio=True))
+    if not audio_streams:
+        raise ValueError("No audio stream available")
+    if STREAM_MAX_FILESIZE:
+        # When nothing fits under the limit the smallest stream is taken
+        fitting = [stream for stream in audio_streams if stream.filesize_approx <= STREAM_MAX_FILESIZE]
+        audio_streams = fitting or [min(audio_streams, key=lambda stream: stream.filesize_approx)]
+    stream = min(audio_streams, key=stream_rank)
+    # A remux saves the encode, which only pays off if the source isn't much
+    # bigger than the stream that would be encoded instead
+    remuxable = [
+        candidate for candidate in audio_streams
+        if can_remux(candidate, profile) and bitrate_distance(candidate) <= bitrate_distance(stream) + STREAM_REMUX_TOLERANCE
+    ]
+    if STREAM_REMUX_TOLERANCE and remuxable:
+        stream = min(remuxable, key=stream_rank)
+    logging.info(f"Selected audio stream itag {stream.itag} ({stream.parse_codecs()[1]}, {(stream.bitrate or 0) // 1000} kbps, ~{stream.filesize_approx} bytes)")
+    return stream
+
+# Standard MP3 bitrates in kbps, default encodes use the highest one that
+# doesn't exceed the source
+ENCODE_BITRATES = [32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+
+def default_bitrate(stream):
+    # TRANSCODE_BITRATE, capped at the source's bitrate (or the target bitrate
+    # when the source's is unknown): encoding at more than the source has
+    # only grows the file
+    limit = stream.bitrate / 1000 if stream.bitrate else STREAM_TARGET_BITRATE
+    configured = int(TRANSCODE_BITRATE.rstrip('kK'))
+    fitting = [bitrate for bitrate in ENCODE_BITRATES if bitrate <= min(configured, limit)]
+    return f"{fitting[-1] if fitting else ENCODE_BITRATES[0]}k"
+
+def conversion_plan(stream, profile='default'):
+    # Returns the output format and whether the source audio can be copied as is
+    if profile != 'default':
+        return {'format': ENCODING_PROFILES[profile]['format'], 'copy': False, 'profile': profile}
+    if can_remux(stream, profile):
+        return {'format': 'aac', 'copy': True, 'profile': profile}
+    return {'format': 'aac' if TRANSCODE_FORMAT == 'aac' else 'mp3', 'copy': False, 'profile': profile,
+            'bitrate': default_bitrate(stream)}
+
+def plan_encoding(plan):
+    # Short description of the encode, part of streamed object keys
+    if plan['copy']:
+        return 'copy'
+    settings = ENCODING_PROFILES[plan['profile']] or {'bitrate': plan.get('bitrate', TRANSCODE_BITRATE)}
+    if AUDIO_LOUDNORM:
+        settings = {**settings, 'loudnorm': [LOUDNORM_TARGET, LOUDNORM_TRUE_PEAK, LOUDNORM_RANGE]}
+    return json.dumps(settings, sort_keys=True)
+
+def encode_args(plan):
+    settings = ENCODING_PROFILES[plan['profile']]
+    args = {'acodec': AUDIO_FORMATS[plan['format']]['acodec'], 'vn': None, 'threads': 1}
+    if 'quality' in settings:
+        args['q:a'] = settings['quality']
+    else:
+        args['audio_bitrate'] = settings.get('bitrate', plan.get('bitrate', TRANSCODE_BITRATE))
+    if 'channels' in settings:
+        args['ac'] = settings['channels']
+    if 'sample_rate' in settings:
+        args['ar'] = settings['sample_rate']
+    return args
+
+def output_args(plan, piped=False, tags=None, container=None):
+    container = container or AUDIO_FORMATS[plan['format']]['format']
+    if plan['copy']:
+        args = {'format': container, 'acodec': 'copy', 'vn': None}
+    else:
+        args = {'format': container, **encode_args(plan)}
+    if container == 'ipod':
+        # A pipe can't be seeked back to write the index, so piped m4a is
+        # fragmented. Audio has no keyframes to cut on, fragments are cut every
+        # ten seconds instead, with offsets relative to each fragment.
+        if piped:
+            args['movflags'] = 'empty_moov+default_base_moof'
+            args['frag_duration'] = 10000000
+        else:
+            args['movflags'] = '+faststart'
+    # ffmpeg-python needs a distinct keyword per repeated -metadata option
+    for index, (name, value) in enumerate((tags or {}).items()):
+        if value:
+            args[f'metadata:g:{index}'] = f'{name}={value}'
+    return args
+
+def loudness_filter(audio, loudness):
+    # Linear normalization from the whole file's measurement. loudnorm only
+    # stays linear while the gain keeps the peak under target and the range
+    # is within LRA, otherwise it would turn dynamic again per segment, so a
+    # gain that would clip is capped at the peak by a plain volume filter and
+    # the range is never compressed.
+    measured_i = float(loudness['input_i'])
+    measured_tp = float(loudness['input_tp'])
+    if measured_tp + LOUDNORM_TARGET - measured_i > LOUDNORM_TRUE_PEAK:
+        return audio.filter('volume', f'{LOUDNORM_TRUE_PEAK - measured_tp:.2f}dB')
+    return audio.filter(
+        'loudnorm', I=LOUDNORM_TARGET, TP=LOUDNORM_TRUE_PEAK,
+        LRA=max(LOUDNORM_RANGE, float(loudness['input_lra'])),
+        measured_I=loudness['input_i'], measured_TP=loudness['input_tp'],
+        measured_LRA=loudness['input_lra'], measured_thresh=loudness['input_thresh'],
+        offset=loudness['target_offset'], linear='true'
+    )
+
+def episode_graph(source, target, plan, piped=False, tags=None, artwork=None, container=None, loudness=None, **extra_args):
+    # One ffmpeg invocation for the whole episode: decode, normalize loudness,
+    # encode, and write the tags and cover art, so post-processing costs a
+    # single decode and encode
+    audio = source.audio
+    if not plan['copy'] and AUDIO_LOUDNORM:
+        if loudness:
+            audio = loudness_filter(audio, loudness)
+        else:
+            audio = audio.filter('loudnorm', I=LOUDNORM_TARGET, TP=LOUDNORM_TRUE_PEAK, LRA=LOUDNORM_RANGE)
+    args = {**output_args(plan, piped, tags, container), **extra_args}
+    if not plan['copy'] and AUDIO_LOUDNORM and 'ar' not in args:
+        # loudnorm resamples to 192 kHz internally, the output goes back to CD rate
+        args['ar'] = 44100
+    streams = [audio]
+    # Fragmented m4a has nowhere to keep cover art, so piped AAC goes without
+    if artwork and not (piped and plan['format'] == 'aac'):
+        streams.append(ffmpeg.input(artwork).video)
+        del args['vn']
+        args.update({'vcodec': 'mjpeg', 'disposition:v:0': 'attached_pic'})
+        if plan['format'] == 'mp3':
+            args['id3v2_version'] = 3
+    return ffmpeg.output(*streams, target, **args)
+
+def run(stream):
+    # Raises ffmpeg.Error with ffmpeg's stderr on failure
+    stream.global_args('-loglevel', 'error').overwrite_output().run(capture_stdout=True, capture_stderr=True)
+
+@contextmanager
+def host_slot():
+    # Holds one of the host's TRANSCODE_HOST_SLOTS, each a lock file shared by
+    # every worker process. flock is released by the kernel if the process
+    # dies, so a crashed worker never leaks its slot.
+    os.makedirs(TRANSCODE_SLOTS_DIR, exist_ok=True)
+    while True:
+        for index in range(TRANSCODE_HOST_SLOTS):
+            slot = open(os.path.join(TRANSCODE_SLOTS_DIR, f'{index}.lock'), 'w')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                slot.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(slot, fcntl.LOCK_UN)
+                slot.close()
+            return
+        time.sleep(0.2)
+
+def run_encode(stream):
+    with encode_slots, host_slot():
+        run(stream)
+
+def run_segment(stream):
+    with host_slot():
+        run(stream)
+
+def probe_audio(path):
+    # Duration in seconds and sample rate of the file's audio
+    probe = ffmpeg.probe(path)
+    audio = next(stream for stream in probe['streams'] if stream['codec_type'] == 'audio')
+    return float(probe['format']['duration']), int(audio['sample_rate'])
+
+def output_sample_rate(plan, source_rate):
+    settings = ENCODING_PROFILES[plan['profile']]
+    if 'sample_rate' in settings:
+        return int(settings['sample_rate'])
+    return 44100 if AUDIO_LOUDNORM else source_rate
+
+def frame_samples(plan, sample_rate):
+    # Samples per AAC frame, or per MP3 frame (MPEG-2 rates use half frames)
+    if plan['format'] == 'aac':
+        return 1024
+    return 1152 if sample_rate >= 32000 else 576
+
+def mp3_frame_length(header):
+    if header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        raise ValueError("Lost MP3 frame sync")
+    version = (header[1] >> 3) & 3
+    bitrate = MP3_BITRATES[1 if version == 3 else 2][header[2] >> 4] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][(header[2] >> 2) & 3]
+    padding = (header[2] >> 1) & 1
+    return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+def adts_frame_length(header):
+    if header[0] != 0xFF or header[1] & 0xF0 != 0xF0:
+        raise ValueError("Lost ADTS frame sync")
+    return ((header[3] & 3) << 11) | (header[4] << 3) | (header[5] >> 5)
+
+def copy_frames(segment_path, output, plan, skip, keep=None):
+    # Appends frames skip to skip + keep of the segment (all of the rest
+    # without keep) to output, the elementary stream being joined
+    frame_length = adts_frame_length if plan['format'] == 'aac' else mp3_frame_length
+    with open(segment_path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    index = 0
+    while offset + 7 <= len(data) and (keep is None or index < skip + keep):
+        length = frame_length(data[offset:offset + 7])
+        if index >= skip:
+            output.write(data[offset:offset + length])
+        offset += length
+        index += 1
+
+def analyze_audio(path):
+    # Midpoints of the silences in the file and, when normalizing, loudnorm's
+    # measurement of the whole file, both from one decode-only pass
+    audio = ffmpeg.input(path).audio.filter('silencedetect', noise='-35dB', d=0.3)
+    if AUDIO_LOUDNORM:
+        audio = audio.filter('loudnorm', I=LOUDNORM_TARGET, TP=LOUDNORM_TRUE_PEAK, LRA=LOUDNORM_RANGE, print_format='json')
+    # A full decode (and loudnorm at 192 kHz), so it counts against the host's budget
+    with host_slot():
+        _, stderr = (
+            audio
+            .output('-', format='null')
+            .global_args('-nostats')
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+    log = stderr.decode('utf-8', 'replace')
+    starts = [float(value) for value in re.findall(r'silence_start: (-?[\d.]+)', log)]
+    ends = [float(value) for value in re.findall(r'silence_end: ([\d.]+)', log)]
+    measurement = re.search(r'\{[^{}]*"input_i"[^{}]*\}', log)
+    loudness = json.loads(measurement.group(0)) if measurement else None
+    return [(start + end) / 2 for start, end in zip(starts, ends)], loudness
+
+def segment_bounds(duration, silences):
+    cuts = []
+    target = TRANSCODE_SEGMENT_SECONDS
+    # The last segment is never shorter than half a segment
+    while target < duration - TRANSCODE_SEGMENT_SECONDS / 2:
+        nearby = [point for point in silences if abs(point - target) <= TRANSCODE_SILENCE_WINDOW and (not cuts or point > cuts[-1])]
+        cut = min(nearby, key=lambda point: abs(point - target)) if nearby else target
+        cuts.append(cut)
+        target = cut + TRANSCODE_SEGMENT_SECONDS
+    edges = [0] + cuts + [duration]
+    return list(zip(edges, edges[1:]))
+
+def encode_segment(source_path, segment_path, start, end, plan, sample_rate, loudness):
+    # Encodes the segment from start to end, both in seconds (end None for
+    # the rest of the file). Input-side seeking decodes up to the exact start,
+    # and every segment starts on a frame boundary, so frame n of any segment
+    # holds the same stretch of audio as the matching frame of one whole encode.
+    source = ffmpeg.input(source_path, ss=f'{start:.6f}', **({'t': f'{end - start:.6f}'} if end is not None else {}))
+    run_segment(episode_graph(source, segment_path, plan, container=SEGMENT_FORMATS[plan['format']],
+                              loudness=loudness, ar=sample_rate, **SEGMENT_ARGS[plan['format']]))
+    return segment_path
+
+def transcode_segments(source_path, output_path, plan, tags, artwork, duration, source_rate):
+    segments_dir = output_path + '.segments'
+    os.makedirs(segments_dir, exist_ok=True)
+    sample_rate = output_sample_rate(plan, source_rate)
+    frame = frame_samples(plan, sample_rate)
+    overlap = math.ceil(SEGMENT_OVERLAP * sample_rate / frame)
+    try:
+        # Segment bounds in frames, the first segment starts at frame 0
+        silences, loudness = analyze_audio(source_path)
+        if AUDIO_LOUDNORM and not loudness:
+            raise ValueError(f"No loudness measurement for {source_path}")
+        bounds = segment_bounds(duration, silences)
+        edges = [round(start * sample_rate / frame) for start, _ in bounds]
+        frame_bounds = list(zip(edges, edges[1:] + [None]))
+        extension = SEGMENT_FORMATS[plan['format']]
+        futures = []
+        for index, (first, last) in enumerate(frame_bounds):
+            lead = min(overlap, first)
+            end = (last + overlap) * frame / sample_rate if last is not None else None
+            segment_path = os.path.join(segments_dir, f'{index:04d}.{extension}')
+            futures.append((lead, last - first if last is not None else None, encode_pool.submit(
+                encode_segment, source_path, segment_path, (first - lead) * frame / sample_rate, end, plan, sample_rate, loudness
+            )))
+
+        # The overlap before each cut, with the priming it absorbed, and the
+        # overlap after it, with the padding, are dropped as the frames are joined
+        joined_path = os.path.join(segments_dir, f'joined.{extension}')
+        with open(joined_path, 'wb') as joined:
+            for lead, keep, future in futures:
+                copy_frames(future.result(), joined, plan, lead, keep)
+
+        extra_args = {'bsf:a': 'aac_adtstoasc'} if plan['format'] == 'aac' else {}
+        run(episode_graph(ffmpeg.input(joined_path), output_path, {**plan, 'copy': True}, tags=tags, artwork=artwork, **extra_args))
+    finally:
+        shutil.rmtree(segments_dir, ignore_errors=True)
+    logging.info(f"Transcoded {source_path} to {output_path} in {len(bounds)} parallel segments")
+
+def transcode_file(source_path, output_path, plan, tags=None, artwork=None):
+    # ffmpeg reads the downloaded source and writes the episode directly
+    if plan['copy']:
+        run(episode_graph(ffmpeg.input(source_path), output_path, plan, tags=tags, artwork=artwork))
+        logging.info(f"Remuxed {source_path} to {output_path}")
+        return output_path
+
+    duration, source_rate = probe_audio(source_path)
+    if duration > TRANSCODE_SEGMENT_THRESHOLD:
+        transcode_segments(source_path, output_path, plan, tags, artwork, duration, source_rate)
+        return output_path
+
+    encode_pool.submit(run_encode, episode_graph(ffmpeg.input(source_path), output_path, plan, tags=tags, artwork=artwork)).result()
+    logging.info(f"Transcoded {source_path} to {output_path}")
+    return output_path
+
+def transcode_stream(chunks, plan, tags=None, artwork=None):
+    # Feeds the source chunks to ffmpeg's stdin and yields the encoded audio
+    # from its stdout, so nothing is written to disk on the way. Encodes wait
+    # for an encode slot like files do, remuxes don't need one.
+    if plan['copy']:
+        yield from stream_process(chunks, plan, tags, artwork)
+        return
+    with encode_slots, host_slot():
+        yield from stream_process(chunks, plan, tags, artwork)
+
+def stream_process(chunks, plan, tags, artwork):
+    process = (
+        episode_graph(ffmpeg.input('pipe:0'), 'pipe:1', plan, piped=True, tags=tags, artwork=artwork)
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdin=True, pipe_stdout=True, pipe_stderr=True)
+    )
+    errors = []
+    stderr = []
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    # stderr is drained too so a chatty ffmpeg can't block on a full pipe
+    drainer = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+    feeder.start()
+    drainer.start()
+    try:
+        for data in iter(lambda: process.stdout.read(READ_SIZE), b''):
+            yield data
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        feeder.join()
+        drainer.join()
+
+    if errors:
+        raise errors[0]
+    if process.returncode:
+        raise ffmpeg.Error('ffmpeg', None, b''.join(stderr))
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import logging
+import threading
+from urllib.error import HTTPError
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pytube import request
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# One keep-alive session per worker process for every request pytube and the
+# downloader make, so YouTube and googlevideo connections (and their TLS
+# sessions) are reused. HTTP_POOL_SIZE connections are kept per host, enough
+# for every download connection of every download worker at once.
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 16))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+# Only failed connects are retried here, nothing has been sent at that point
+HTTP_CONNECT_RETRIES = int(os.getenv('HTTP_CONNECT_RETRIES', 3))
+HTTP_STREAM_RETRIES = int(os.getenv('HTTP_STREAM_RETRIES', 5))
+# Server trouble and rate limiting pass, a 403 or 404 (an expired or bad URL) doesn't
+HTTP_STREAM_RETRY_STATUSES = (429, 500, 502, 503, 504)
+READ_SIZE = 64 * 1024
+
+HEADERS = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+
+session = None
+session_lock = threading.Lock()
+
+
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=8,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=Retry(total=None, connect=HTTP_CONNECT_RETRIES, read=0, status=0, redirect=5, backoff_factor=0.5)
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        return session
+
+def request_timeout(timeout):
+    # pytube passes socket's default-timeout sentinel when no timeout was asked for
+    if isinstance(timeout, (int, float)):
+        return (HTTP_CONNECT_TIMEOUT, timeout)
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+class PooledResponse:
+    # The parts of urlopen's response that pytube uses. The body is read
+    # eagerly so the connection goes straight back to the pool.
+    def __init__(self, response):
+        self.response = response
+
+    def read(self):
+        return self.response.content
+
+    def info(self):
+        return self.response.headers
+
+
+def execute_request(url, method=None, headers=None, data=None, timeout=None):
+    if not url.lower().startswith("http"):
+        raise ValueError("Invalid URL")
+    if data and not isinstance(data, bytes):
+        data = bytes(json.dumps(data), encoding="utf-8")
+    response = get_session().request(
+        method or ('POST' if data else 'GET'), url,
+        headers={**HEADERS, **(headers or {})}, data=data, timeout=request_timeout(timeout)
+    )
+    # pytube expects urlopen's behaviour of raising on error statuses
+    if response.status_code >= 400:
+        raise HTTPError(url, response.status_code, response.reason, response.headers, None)
+    return PooledResponse(response)
+
+
+def stream(url, timeout=None, max_retries=None):
+    # Yields the media in READ_SIZE chunks, one ranged request at a time. A
+    # failed range is requested again from the first byte still missing.
+    # Without a known size the media comes in one request, which can't be resumed.
+    # pytube's Stream.download passes max_retries=0, so retries are always
+    # HTTP_STREAM_RETRIES and max_retries is only taken when it asks for more.
+    max_retries = max(max_retries or 0, HTTP_STREAM_RETRIES)
+    file_size = request.filesize(url)
+    downloaded = 0
+    tries = 0
+    while not file_size or downloaded < file_size:
+        if file_size:
+            stop_pos = min(downloaded + request.default_range_size, file_size) - 1
+            range_url = url + f"&range={downloaded}-{stop_pos}"
+        else:
+            range_url = url
+        received = 0
+        try:
+            with get_session().get(range_url, headers=HEADERS, stream=True, timeout=request_timeout(timeout)) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(READ_SIZE):
+                    downloaded += len(chunk)
+                    received += len(chunk)
+                    yield chunk
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError, requests.exceptions.ChunkedEncodingError) as e:
+            if isinstance(e, requests.HTTPError) and e.response.status_code not in HTTP_STREAM_RETRY_STATUSES:
+                raise
+            tries += 1
+            if tries > max_retries or (not file_size and downloaded):
+                raise
+            logging.info(f"Retrying stream from byte {downloaded} after error: {e}")
+            time.sleep(min(2 ** tries, 30))
+            continue
+        if not file_size:
+            return
+        if not received:
+            tries += 1
+            if tries > max_retries:
+                raise IOError(f"Range {downloaded}-{stop_pos} returned no data")
+
+
+def install_transport():
+    request._execute_request = execute_request
+    request.stream = stream